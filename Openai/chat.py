@@ -9,6 +9,7 @@ from typing import Dict, List, Optional, Callable, Any, Tuple
 
 from termcolor import colored
 from .messages import BaseMessage, AssistantMessage, Role
+from .client import shared_client
 from .function import Function, Functions, FunctionCall
 import logging
 from tenacity import retry, wait_random_exponential, stop_after_attempt
@@ -23,14 +24,15 @@ class OpenAIChat:
         if not api_key:
             raise ValueError('Open AI api key cannot be empty')
 
-        self.client = AsyncOpenAI(
-            api_key=api_key,
-            max_retries=3,
-        )
+        self.api_key = api_key
         self.model = model
         self.config = config
         self.logger = logging.getLogger(__name__)
 
+    @property
+    def client(self) -> AsyncOpenAI:
+        return shared_client(self.api_key)
+
     async def completion(
         self,
         messages: List[BaseMessage],
@@ -0,0 +1,13 @@
+import functools
+
+from openai import AsyncOpenAI
+
+
+@functools.lru_cache(maxsize=None)
+def shared_client(api_key: str) -> AsyncOpenAI:
+    # Built on the first request and shared by the chat, speech and transcription wrappers of a key,
+    # so commands that never call the API do not build one and the rest share one connection pool
+    return AsyncOpenAI(
+        api_key=api_key,
+        max_retries=3,
+    )
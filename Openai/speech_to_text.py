@@ -4,6 +4,7 @@ from typing import Literal, List
 from openai import AsyncOpenAI
 from openai._types import FileTypes, NotGiven, NOT_GIVEN
 from openai.types.audio import Transcription
+from .client import shared_client
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 
 
@@ -21,14 +22,15 @@ class SpeechToText:
         if 'word' in (timestamp_granularities or []) and response_format != 'verbose_json':
             raise ValueError('If timestamp_granularity has `word`, response_format must be verbose_json')
 
-        self.client = AsyncOpenAI(
-            api_key=api_key,
-            max_retries=3,
-        )
+        self.api_key = api_key
         self.model = model
         self.timestamp_granularities = timestamp_granularities or ['segment']
         self.response_format = response_format
 
+    @property
+    def client(self) -> AsyncOpenAI:
+        return shared_client(self.api_key)
+
     @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
     async def speech_to_text(
         self,
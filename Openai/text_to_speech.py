@@ -2,6 +2,7 @@ from enum import Enum
 from typing import Literal
 
 from openai import AsyncOpenAI
+from .client import shared_client
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 
 
@@ -25,14 +26,15 @@ class TextToSpeech:
         if not api_key:
             raise ValueError('Open AI api key cannot be empty')
 
-        self.client = AsyncOpenAI(
-            api_key=api_key,
-            max_retries=3,
-        )
+        self.api_key = api_key
         self.model = model
         self.voice = voice
         self.response_format = response_format
 
+    @property
+    def client(self) -> AsyncOpenAI:
+        return shared_client(self.api_key)
+
     @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
     async def text_to_speech(self, text: str, speed: float = 1.0) -> bytes:
         response = await self.client.audio.speech.create(
@@ -1,23 +1,27 @@
-import json
+import argparse
+import functools
 import os
 from datetime import datetime
-from os import PathLike
-from typing import List
+from typing import Optional, TYPE_CHECKING
 
-import json5
 from dotenv import load_dotenv
-import uuid
-from pathlib import Path
 
-from editor import Editor, StockFinder
-from narrator import Narrator
-from scenario import Writer
-
-from dataobjects import Scenario
+from cache import ArtifactCache
+from dataobjects import AudioMixSettings, output_target
+from jobs import JobStore
+from pipeline import Pipeline, StageLimits, API_STAGES
+from tracing import tracer
 
 import logging
 import asyncio
 
+# Each command imports only what it uses, so asking for a scenario does not load moviepy
+if TYPE_CHECKING:
+    from editor import Editor, StockFinder
+    from narrator import Narrator
+    from render import RenderFarm
+    from scenario import Writer
+
 load_dotenv()
 logging.basicConfig(
     format="(%(asctime)s) %(name)s:%(lineno)d [%(levelname)s] | %(message)s", level=logging.INFO
@@ -27,111 +31,163 @@ logger = logging.getLogger(__name__)
 openai_api_key = os.getenv('OPENAI_API_KEY')
 pexels_api_key = os.getenv('PEXELS_API_KEY')
 
-writer = Writer(openai_api_key)
-narrator = Narrator(openai_api_key)
-editor = Editor()
-stock = StockFinder(pexels_api_key, openai_api_key)
+themes = [
+    "Финансовая грамотность: ключ к стабильности",
+    "Победа над долгами: стратегии финансового освобождения",
+    "Секреты миллионеров: как создать состояние с нуля",
+    "Рост доходов: практические советы по увеличению заработка",
+    "Успех в социальных сетях: монетизация и личный бренд",
+    "Империя недвижимости: инвестиции и управление",
+    "Ментальность предпринимателя: мышление на миллионы",
+    "Фриланс: свобода и доход без офиса",
+    "Пассивный доход: создание источников стабильного заработка",
+    "Успешные переговоры: искусство договариваться и выигрывать"
+]
+
+
+@functools.lru_cache
+def get_writer() -> 'Writer':
+    from scenario import Writer
+
+    return Writer(openai_api_key)
+
+
+@functools.lru_cache
+def get_narrator() -> 'Narrator':
+    from narrator import Narrator
+
+    return Narrator(openai_api_key)
+
+
+@functools.lru_cache
+def get_editor() -> 'Editor':
+    from editor import Editor
+
+    return Editor()
+
+
+@functools.lru_cache
+def get_stock() -> 'StockFinder':
+    from editor import StockFinder
+
+    return StockFinder(pexels_api_key, openai_api_key)
+
 
+def today_output_directory(base_output_directory: str = 'output') -> str:
+    return f'{base_output_directory}/{datetime.now().strftime("%Y-%m-%d")}'
 
-async def main():
-    base_output_directory = 'output'
-    today_output_directory = f'{base_output_directory}/{datetime.now().strftime("%Y-%m-%d")}'
-    today_video_output_directory = f'{today_output_directory}/videos'
 
-    Path(today_output_directory).mkdir(parents=True, exist_ok=True)
-    Path(today_video_output_directory).mkdir(parents=True, exist_ok=True)
+async def resolve_encoding() -> str:
+    # auto benchmarks the encoding profiles on this machine against ENCODING_TARGET_SECONDS_PER_MINUTE.
+    # The benchmark runs ffmpeg for a while, so it stays off the event loop
+    encoding = os.getenv('ENCODING_PROFILE', 'production')
+    if encoding == 'auto':
+        from encoding import tuned_profile
 
-    themes = [
-        "Финансовая грамотность: ключ к стабильности",
-        "Победа над долгами: стратегии финансового освобождения",
-        "Секреты миллионеров: как создать состояние с нуля",
-        "Рост доходов: практические советы по увеличению заработка",
-        "Успех в социальных сетях: монетизация и личный бренд",
-        "Империя недвижимости: инвестиции и управление",
-        "Ментальность предпринимателя: мышление на миллионы",
-        "Фриланс: свобода и доход без офиса",
-        "Пассивный доход: создание источников стабильного заработка",
-        "Успешные переговоры: искусство договариваться и выигрывать"
-    ]
+        encoding = (await asyncio.to_thread(tuned_profile, ArtifactCache())).name
 
-    for theme in themes:
-        video_id = uuid.uuid5(uuid.NAMESPACE_DNS, theme)
+    return encoding
 
-        scenario_filename = f'{today_output_directory}/scenario_{video_id}.json'
-        if not os.path.exists(scenario_filename):
-            scenario_result = await writer.write_scenario(
-                subject=theme,
-            )
 
-            if scenario_result.is_err():
-                logger.error(scenario_result)
+def create_pipeline(
+    output_directory: str,
+    render_mode: str = 'full',
+    render_farm: Optional['RenderFarm'] = None,
+    encoding: Optional[str] = None
+) -> Pipeline:
+    # Without a render farm only the API stages can run, so the editor and moviepy are left unloaded
+    editor = get_editor() if render_farm is not None else None
+    stock = get_stock() if render_farm is not None else None
 
-                exit(1)
+    # Comma separated names from OUTPUT_TARGETS in dataobjects, every full render is written in each format
+    targets = [output_target(name.strip()).name for name in os.getenv('OUTPUT_TARGETS', '').split(',') if name.strip()]
 
-            scenario: Scenario = scenario_result.ok()
+    return Pipeline(
+        get_writer(),
+        get_narrator(),
+        editor,
+        stock,
+        render_farm,
+        ArtifactCache(),
+        JobStore(),
+        output_directory=output_directory,
+        video_output_directory=f'{output_directory}/videos',
+        limits=StageLimits.from_env(),
+        draft=render_mode == 'draft',
+        encoding=encoding,
+        audio_mix=AudioMixSettings.from_env(),
+        targets=targets or None,
+    )
 
-            with open(scenario_filename, 'w') as f:
-                json5.dump(scenario.to_json(), f, ensure_ascii=False, indent=4)
 
-        with open(scenario_filename, 'r') as f:
-            scenario = Scenario.from_dict(json5.load(f))
+async def render(selected_themes: list, render_mode: str):
+    from render import RenderFarm
 
-        narration_filename = f'{today_output_directory}/narrate_{video_id}.mp3'
+    output_directory = today_output_directory()
+    editor = get_editor()
 
-        if not os.path.exists(narration_filename):
-            mp3_bytes = await narrator.narrate(scenario)
+    # Index stock footage downloaded before the library index existed
+    editor.library.scan()
 
-            with open(narration_filename, 'wb') as f:
-                f.write(mp3_bytes)
+    # Decode and loudness-normalize songs added since the last run
+    editor.music.scan()
 
-        scenario.narration_path = narration_filename
+    render_farm = RenderFarm()
+    pipeline = create_pipeline(output_directory, render_mode, render_farm, await resolve_encoding())
 
-        subtitles_path = f'{today_output_directory}/subtitles_{video_id}.json'
+    try:
+        if render_mode == 'finalize':
+            await pipeline.finalize(selected_themes)
+        else:
+            await pipeline.run(selected_themes)
+    finally:
+        render_farm.shutdown()
+        tracer.export(f'{output_directory}/traces')
 
-        if not os.path.exists(subtitles_path):
-            subtitles = await narrator.get_subtitles(narration_filename)
 
-            with open(subtitles_path, 'w') as f:
-                json5.dump(subtitles, f, ensure_ascii=False, indent=4)
+async def run_stage(selected_themes: list, stage: str):
+    output_directory = today_output_directory()
+    pipeline = create_pipeline(output_directory)
 
-        # Load the subtitles from the JSON file
-        with open(subtitles_path, 'r') as f:
-            subtitles_json = json5.load(f)
+    try:
+        for theme in selected_themes:
+            print(f'{theme}: {await pipeline.run_until(theme, stage)}')
+    finally:
+        tracer.export(f'{output_directory}/traces')
 
-        narrator.add_transcription_words_and_subtitles(scenario, subtitles_json)
-        editor.split_words_into_lines(scenario)
-        subtitles_clips = editor.get_subtitles_clips(scenario)
 
-        try:
-            await stock.add_stock_video_candidates(scenario)
+def main():
+    parser = argparse.ArgumentParser(description='Generates short videos from themes')
+    commands = parser.add_subparsers(dest='command')
 
-            stock_video_clips = editor.get_stock_video_clips(scenario)
-        except Exception as e:
-            logger.error(e)
-            logger.info(scenario)
+    # draft renders a low resolution preview, finalize re-renders the stored drafts at full quality
+    run_parser = commands.add_parser('run', help='Run every stage and render the videos')
+    run_parser.add_argument('--mode', choices=['full', 'draft', 'finalize'], default=os.getenv('RENDER_MODE', 'full'))
 
-            raise e
+    theme_parsers = [run_parser, commands.add_parser('finalize', help='Re-render the approved drafts at full quality')]
+    for stage in API_STAGES:
+        theme_parsers.append(commands.add_parser(stage, help=f'Run the stages up to {stage} and print its artifact'))
 
-        background_music = editor.get_background_music()
+    for theme_parser in theme_parsers:
+        theme_parser.add_argument('themes', nargs='*', help='Themes to process, the built-in list by default')
 
-        output_path = f'{today_video_output_directory}/{theme}.mp4'
+    commands.add_parser('daemon', help='Serve the job API')
 
-        try:
-            editor.compose_video(
-                subtitles_clips,
-                stock_video_clips,
-                background_music,
-                narration_filename,
-                output_path
-            )
-        except Exception as e:
-            logger.error(e)
-            logger.info(scenario)
+    args = parser.parse_args()
+    command = args.command or 'run'
+    selected_themes = getattr(args, 'themes', None) or themes
 
-            raise e
+    if command == 'daemon':
+        from daemon import Daemon
 
-        print('Done ' + theme)
+        asyncio.run(Daemon().serve())
+    elif command in API_STAGES:
+        asyncio.run(run_stage(selected_themes, command))
+    elif command == 'finalize':
+        asyncio.run(render(selected_themes, 'finalize'))
+    else:
+        asyncio.run(render(selected_themes, getattr(args, 'mode', None) or os.getenv('RENDER_MODE', 'full')))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
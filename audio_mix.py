@@ -0,0 +1,74 @@
+import tempfile
+import wave
+from typing import Optional
+
+import numpy as np
+
+from dataobjects import AudioMixSettings
+from tracing import traced
+from transcode import decode_audio, run_ffmpeg, encode_audio_args
+
+SAMPLE_RATE = 44100
+
+
+def ducking_gain(narration: np.ndarray, settings: AudioMixSettings, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    window = max(1, int(sample_rate * settings.window_seconds))
+    windows = -(-len(narration) // window)
+
+    # Loudness of the narration per window decides where the music steps back
+    mono = np.zeros(windows * window, dtype=np.float32)
+    mono[:len(narration)] = narration.mean(axis=1)
+    rms = np.sqrt(np.mean(np.square(mono.reshape(windows, window)), axis=1))
+
+    speech = rms > 10 ** (settings.speech_threshold_db / 20)
+    gain = np.where(speech, 10 ** (-settings.duck_db / 20), 1.0)
+
+    # A moving average turns the steps into ramps, so the music fades instead of jumping
+    smoothing = max(1, int(settings.smoothing_seconds / settings.window_seconds))
+    gain = np.convolve(np.pad(gain, smoothing // 2, mode='edge'), np.ones(smoothing) / smoothing, mode='same')
+    gain = gain[smoothing // 2:smoothing // 2 + windows]
+
+    return np.repeat(gain, window)[:len(narration)].astype(np.float32)
+
+
+def mix_audio(narration: np.ndarray, music: np.ndarray, settings: AudioMixSettings) -> np.ndarray:
+    # The music is cut to the narration, and a shorter song leaves silence like the moviepy mix did
+    music_bed = np.zeros_like(narration)
+    length = min(len(narration), len(music))
+    music_bed[:length] = music[:length] * settings.music_volume
+
+    if settings.duck_db > 0:
+        music_bed *= ducking_gain(narration, settings)[:, np.newaxis]
+
+    return np.clip(narration + music_bed, -1.0, 1.0)
+
+
+def write_wav(samples: np.ndarray, path: str, sample_rate: int = SAMPLE_RATE):
+    pcm = (samples * 32767).astype('<i2')
+
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(samples.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+@traced()
+def render_audio_mix(
+    narration_path: str,
+    music: np.ndarray,
+    output_path: str,
+    settings: Optional[AudioMixSettings] = None
+) -> str:
+    settings = settings or AudioMixSettings()
+
+    # The music comes decoded and normalized from the music library
+    mixed = mix_audio(decode_audio(narration_path, SAMPLE_RATE), music, settings)
+
+    # The mix is encoded once, so every render only has to copy the track into its container
+    with tempfile.TemporaryDirectory() as directory:
+        wav_path = f'{directory}/mix.wav'
+        write_wav(mixed, wav_path)
+        run_ffmpeg(encode_audio_args(wav_path, output_path))
+
+    return output_path
@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import numpy as np
+from moviepy.video.VideoClip import ColorClip, VideoClip
+from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+
+from captions import caption_line_clip
+from compositor import composite_layers
+from dataobjects import TextLine, TranscriptionWord, FULL_RENDER
+from editor import Editor
+
+
+def stock_clip(frame_size, start, duration, seed) -> VideoClip:
+    # A fixed noise frame, so the benchmark measures compositing rather than decoding
+    frame = np.random.default_rng(seed).integers(0, 256, (frame_size[1], frame_size[0], 3), dtype=np.uint8)
+
+    return VideoClip(lambda t: frame, duration=duration).set_start(start)
+
+
+def caption_clips(frame_size, duration, words_per_line=4, word_duration=0.3) -> list:
+    words = [f'слово{i}' for i in range(int(duration / word_duration))]
+    clips = []
+
+    for line_start in range(0, len(words), words_per_line):
+        line_words = [
+            TranscriptionWord(i * word_duration, (i + 1) * word_duration, words[i])
+            for i in range(line_start, min(line_start + words_per_line, len(words)))
+        ]
+        line = TextLine(' '.join(word.word for word in line_words), line_words[0].start, line_words[-1].end, line_words)
+        placements, highlights = Editor.layout_caption(line, frame_size)
+        clips.append(caption_line_clip(placements, highlights, line.start, line.end))
+
+    return clips
+
+
+def measure(clip: VideoClip, times) -> float:
+    started = time.perf_counter()
+
+    for t in times:
+        clip.get_frame(t)
+
+    return len(times) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Frames per second of the moviepy compositor against composite_layers')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--block', type=float, default=2.5, help='stock clip length in seconds')
+    parser.add_argument('--fps', type=int, default=FULL_RENDER.fps)
+    args = parser.parse_args()
+
+    frame_size = FULL_RENDER.frame_size
+    background = ColorClip(size=frame_size, color=(0, 0, 0)).set_duration(args.duration)
+    stock = [
+        stock_clip(frame_size, start, min(args.block, args.duration - start), seed)
+        for seed, start in enumerate(np.arange(0, args.duration, args.block))
+    ]
+    layers = [background] + stock + caption_clips(frame_size, args.duration)
+    times = np.arange(0, args.duration, 1 / args.fps)
+
+    before = CompositeVideoClip(layers)
+    after = composite_layers(layers, frame_size)
+
+    for t in times[::args.fps]:
+        assert np.array_equal(before.get_frame(t), after.get_frame(t)), f'frames differ at {t:.2f}s'
+
+    before_fps = measure(before, times)
+    after_fps = measure(after, times)
+
+    print(f'{len(layers)} layers, {len(times)} frames of {frame_size[0]}x{frame_size[1]}')
+    print(f'CompositeVideoClip: {before_fps:8.1f} fps')
+    print(f'composite_layers:   {after_fps:8.1f} fps ({after_fps / before_fps:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
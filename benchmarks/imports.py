@@ -0,0 +1,57 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    'import app': ['-c', 'import app'],
+    'import pipeline': ['-c', 'import pipeline'],
+    'import editor': ['-c', 'import editor'],
+    'app.py --help': ['app.py', '--help'],
+    'app.py scenario --help': ['app.py', 'scenario', '--help'],
+}
+
+HEAVY_MODULES = ['moviepy', 'numpy', 'openai', 'aiohttp']
+
+
+def measure(args, runs: int) -> float:
+    timings = []
+
+    # Every run is a fresh interpreter, the way the CLI is started
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+
+    return statistics.median(timings)
+
+
+def loaded_modules(module: str):
+    check = f'import sys, {module}; print(" ".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+
+    return subprocess.run(
+        [sys.executable, '-c', check], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Start-up time of the CLI and the modules behind it')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = measure(['-c', 'pass'], args.runs)
+    print(f'{"python -c pass":24} {baseline * 1000:8.0f} ms')
+
+    for name, command in COMMANDS.items():
+        print(f'{name:24} {measure(command, args.runs) * 1000:8.0f} ms')
+
+    for module in ['app', 'pipeline']:
+        print(f'{module} loads: {", ".join(loaded_modules(module)) or "none of " + ", ".join(HEAVY_MODULES)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = directory or os.getenv('ARTIFACT_CACHE_DIR', 'cache')
+        self.max_bytes = max_bytes or int(os.getenv('ARTIFACT_CACHE_MAX_BYTES', 20 * 1024 ** 3))
+
+    @staticmethod
+    def key(stage: str, inputs: dict) -> str:
+        payload = json.dumps({'stage': stage, 'inputs': inputs}, sort_keys=True, ensure_ascii=False)
+
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, stage: str, inputs: dict, extension: str) -> str:
+        key = self.key(stage, inputs)
+
+        return f'{self.directory}/{stage}/{key[:2]}/{key}.{extension}'
+
+    def get(self, stage: str, inputs: dict, extension: str) -> Optional[str]:
+        path = self.path(stage, inputs, extension)
+
+        if not os.path.exists(path):
+            return None
+
+        # The modification time doubles as the last access time for eviction
+        os.utime(path)
+
+        return path
+
+    def put_bytes(self, stage: str, inputs: dict, extension: str, data: bytes) -> str:
+        path = self.path(stage, inputs, extension)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+
+        os.replace(tmp_path, path)
+
+        return path
+
+    def put_file(self, stage: str, inputs: dict, extension: str, source_path: str) -> str:
+        path = self.path(stage, inputs, extension)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        # Copied rather than hard-linked: the source is usually an output that the next render to the same
+        # path rewrites in place, which would rewrite a linked cache entry along with it
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        shutil.copyfile(source_path, tmp_path)
+
+        os.replace(tmp_path, path)
+
+        return path
+
+    @staticmethod
+    def restore(cached_path: str, destination_path: str):
+        # The old output is unlinked and the copy moved into place, so no other file is written through it
+        tmp_path = f'{destination_path}.{uuid.uuid4().hex}.tmp'
+        shutil.copyfile(cached_path, tmp_path)
+
+        if os.path.lexists(destination_path):
+            os.remove(destination_path)
+
+        os.replace(tmp_path, destination_path)
+
+    def size(self) -> int:
+        return sum(os.path.getsize(path) for path in Path(self.directory).rglob('*') if path.is_file())
+
+    def evict(self) -> int:
+        if not os.path.isdir(self.directory):
+            return 0
+
+        entries = []
+        for path in Path(self.directory).rglob('*'):
+            if path.is_file():
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total - freed <= self.max_bytes:
+                break
+
+            path.unlink(missing_ok=True)
+            freed += size
+
+        if freed:
+            logger.info(f'Evicted {freed} bytes from the artifact cache ({total - freed} bytes left)')
+
+        return freed
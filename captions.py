@@ -0,0 +1,170 @@
+import bisect
+import functools
+import math
+import os
+from typing import List, Tuple
+
+import numpy as np
+from moviepy.video.VideoClip import VideoClip
+from PIL import Image, ImageDraw, ImageFont
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(font: str, fontsize: int) -> ImageFont.FreeTypeFont:
+    # ImageMagick font names like "Helvetica-Bold" are tried as-is, then as a file name
+    candidates = [os.getenv('CAPTION_FONT_PATH'), font, f'{font}.ttf', 'DejaVuSans-Bold.ttf']
+
+    for candidate in candidates:
+        if not candidate:
+            continue
+
+        try:
+            return ImageFont.truetype(candidate, fontsize)
+        except OSError:
+            continue
+
+    # The bitmap font of Pillow has no Cyrillic and, on older versions, no metrics to lay captions out with
+    raise Exception(
+        f'No TrueType font found for captions (tried {", ".join(c for c in candidates if c)}), '
+        f'set CAPTION_FONT_PATH to a .ttf file'
+    )
+
+
+@functools.lru_cache(maxsize=int(os.getenv('CAPTION_CACHE_SIZE', 4096)))
+def rasterize_word(text: str, font: str, fontsize: int, color: str, bg_color: str = None) -> np.ndarray:
+    pil_font = load_font(font, fontsize)
+    ascent, descent = pil_font.getmetrics()
+
+    width = max(1, math.ceil(pil_font.getlength(text)))
+    height = ascent + descent
+
+    image = Image.new('RGBA', (width, height), bg_color or (0, 0, 0, 0))
+    ImageDraw.Draw(image).text((0, 0), text, font=pil_font, fill=color)
+
+    # The same array is handed out for every cache hit, so nobody may draw on it
+    raster = np.array(image)
+    raster.flags.writeable = False
+
+    return raster
+
+
+Placement = Tuple[np.ndarray, int, int]
+Highlight = Tuple[np.ndarray, int, int, float, float]
+
+
+def overlay_image(size: Tuple[int, int], placements: List[Placement]) -> Image.Image:
+    canvas = Image.new('RGBA', size, (0, 0, 0, 0))
+
+    for raster, x, y in placements:
+        canvas.alpha_composite(Image.fromarray(raster), (x, y))
+
+    return canvas
+
+
+def compose_overlay(size: Tuple[int, int], placements: List[Placement]) -> Tuple[np.ndarray, np.ndarray]:
+    overlay = np.asarray(overlay_image(size, placements))
+
+    return overlay[:, :, :3], overlay[:, :, 3] / 255.0
+
+
+def highlight_intervals(highlights: List[Highlight], start: float, end: float) -> List[Tuple[float, float, tuple]]:
+    # Split the line into intervals with a constant set of highlighted words
+    breakpoints = sorted({start, end, *(
+        min(max(t, start), end) for _, _, _, word_start, word_end in highlights for t in (word_start, word_end)
+    )})
+
+    intervals = []
+    for interval_start, interval_end in zip(breakpoints, breakpoints[1:]):
+        active = tuple(
+            i for i, (_, _, _, word_start, word_end) in enumerate(highlights)
+            if word_start <= interval_start < word_end
+        )
+        intervals.append((interval_start, interval_end, active))
+
+    return intervals
+
+
+def caption_line_clip(placements: List[Placement], highlights: List[Highlight], start: float, end: float) -> VideoClip:
+    rasters = placements + [(raster, x, y) for raster, x, y, _, _ in highlights]
+    left = min(x for _, x, _ in rasters)
+    top = min(y for _, _, y in rasters)
+    right = max(x + raster.shape[1] for raster, x, _ in rasters)
+    bottom = max(y + raster.shape[0] for raster, _, y in rasters)
+    size = (right - left, bottom - top)
+
+    base = [(raster, x - left, y - top) for raster, x, y in placements]
+    highlighted = [(raster, x - left, y - top) for raster, x, y, _, _ in highlights]
+
+    intervals = highlight_intervals(highlights, start, end)
+    interval_starts = [interval_start - start for interval_start, _, _ in intervals]
+    frames = {}
+
+    def overlay_at(t):
+        _, _, active = intervals[max(0, bisect.bisect_right(interval_starts, t) - 1)]
+
+        # Rendering moves forward in time, so only the overlay of the current interval is kept
+        if active not in frames:
+            frames.clear()
+            frames[active] = compose_overlay(size, base + [highlighted[i] for i in active])
+
+        return frames[active]
+
+    duration = end - start
+    mask = VideoClip(lambda t: overlay_at(t)[1], ismask=True, duration=duration)
+
+    return (
+        VideoClip(lambda t: overlay_at(t)[0], duration=duration)
+        .set_mask(mask)
+        .set_start(start)
+        .set_position((left, top))
+    )
+
+
+def write_caption_track(
+    lines: List[Tuple[List[Placement], List[Highlight], float, float]],
+    frame_size: Tuple[int, int],
+    duration: float,
+    directory: str,
+) -> str:
+    # An ffconcat playlist of full-frame RGBA stills, one per highlight interval, that ffmpeg overlays as one stream
+    blank_path = f'{directory}/blank.png'
+    Image.new('RGBA', frame_size, (0, 0, 0, 0)).save(blank_path, compress_level=1)
+
+    entries = []
+    position = 0.0
+
+    for line_index, (placements, highlights, start, end) in enumerate(sorted(lines, key=lambda line: line[2])):
+        start = max(start, position)
+        end = min(end, duration)
+
+        if end <= start:
+            continue
+
+        if start > position:
+            entries.append((blank_path, start - position))
+
+        for interval_index, (interval_start, interval_end, active) in enumerate(highlight_intervals(highlights, start, end)):
+            frame_path = f'{directory}/caption_{line_index:04d}_{interval_index:04d}.png'
+            overlay_image(
+                frame_size,
+                placements + [highlights[i][:3] for i in active]
+            ).save(frame_path, compress_level=1)
+
+            entries.append((frame_path, interval_end - interval_start))
+
+        position = end
+
+    if position < duration:
+        entries.append((blank_path, duration - position))
+
+    playlist_path = f'{directory}/captions.ffconcat'
+    with open(playlist_path, 'w') as f:
+        f.write('ffconcat version 1.0\n')
+
+        for frame_path, frame_duration in entries:
+            f.write(f"file '{os.path.abspath(frame_path)}'\nduration {frame_duration:.6f}\n")
+
+        # The concat demuxer ignores the duration of the last entry unless the file is repeated
+        f.write(f"file '{os.path.abspath(entries[-1][0])}'\n")
+
+    return playlist_path
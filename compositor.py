@@ -0,0 +1,159 @@
+import bisect
+from typing import List, Tuple, Optional
+
+import numpy as np
+from moviepy.video.VideoClip import VideoClip
+from moviepy.video.io.VideoFileClip import VideoFileClip
+
+Span = Tuple[float, float, List[VideoClip]]
+
+
+class ClipReader:
+    def __init__(self, path: str, size: Tuple[int, int]):
+        self.path = path
+        self.size = size
+        self.source = None
+        self.clip = None
+
+    def open(self) -> VideoClip:
+        if self.clip is None:
+            # The audio of stock footage is never used, so no audio reader is started for it
+            self.source = VideoFileClip(self.path, audio=False)
+            self.clip = self.source
+
+            if tuple(self.source.size) != tuple(self.size):
+                self.clip = self.source.resize(newsize=self.size)
+
+        return self.clip
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+
+        self.source = None
+        self.clip = None
+
+
+class LazyVideoFileClip(VideoClip):
+    # Starts its ffmpeg reader on the first frame asked for and stops it on close, which the compositor
+    # calls once the render has moved past the clip. The reader is shared by the copies set_start makes
+    def __init__(self, path: str, size: Tuple[int, int], duration: float):
+        VideoClip.__init__(self, duration=duration)
+        self.reader = ClipReader(path, size)
+        self.size = size
+        self.make_frame = lambda t: self.reader.open().get_frame(t)
+
+    def close(self):
+        self.reader.close()
+
+
+def static_position(clip: VideoClip) -> Optional[Tuple[int, int]]:
+    # Only absolute pixel positions are resolved here, anything else is left to moviepy's blit_on
+    if clip.relative_pos:
+        return None
+
+    pos = clip.pos(0)
+    if isinstance(pos, str) or any(isinstance(value, str) for value in pos):
+        return None
+
+    return int(pos[0]), int(pos[1])
+
+
+def covers_frame(clip: VideoClip, size: Tuple[int, int]) -> bool:
+    return clip.mask is None and tuple(clip.size) == tuple(size) and static_position(clip) == (0, 0)
+
+
+def visible_spans(clips: List[VideoClip], size: Tuple[int, int], duration: float) -> List[Span]:
+    # The set of playing clips only changes at clip boundaries, so visibility is worked out once per span
+    # and every layer under the topmost one that covers the whole frame is left out
+    boundaries = sorted({0.0, duration, *(
+        t for clip in clips for t in (clip.start, clip.end) if t is not None and 0 < t < duration
+    )})
+
+    spans = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        playing = [clip for clip in clips if clip.start <= start and (clip.end is None or start < clip.end)]
+
+        for index in range(len(playing) - 1, -1, -1):
+            if covers_frame(playing[index], size):
+                playing = playing[index:]
+                break
+
+        spans.append((start, end, playing))
+
+    return spans
+
+
+def blit_in_place(frame: np.ndarray, clip: VideoClip, t: float) -> np.ndarray:
+    position = static_position(clip)
+
+    if position is None:
+        return clip.blit_on(frame, t)
+
+    clip_t = t - clip.start
+    image = clip.get_frame(clip_t)
+    mask = clip.mask.get_frame(clip_t) if clip.mask is not None else None
+
+    x, y = position
+    frame_height, frame_width = frame.shape[:2]
+    image_height, image_width = image.shape[:2]
+
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(frame_width, x + image_width), min(frame_height, y + image_height)
+
+    if left >= right or top >= bottom:
+        return frame
+
+    image = image[top - y:bottom - y, left - x:right - x]
+
+    # Opaque layers are copied straight into the frame, only masked layers are alpha blended
+    if mask is None:
+        frame[top:bottom, left:right] = image
+
+        return frame
+
+    mask = mask[top - y:bottom - y, left - x:right - x, np.newaxis]
+    region = frame[top:bottom, left:right]
+    frame[top:bottom, left:right] = 1.0 * mask * image + (1.0 - mask) * region
+
+    return frame
+
+
+def composite_layers(
+    clips: List[VideoClip],
+    size: Tuple[int, int],
+    bg_color: Tuple[int, int, int] = (0, 0, 0)
+) -> VideoClip:
+    duration = max(clip.end for clip in clips)
+    spans = visible_spans(clips, size, duration)
+    span_starts = [start for start, _, _ in spans]
+    background = np.full((size[1], size[0], 3), bg_color, dtype=np.uint8)
+    drawn = []
+
+    def make_frame(t):
+        _, _, layers = spans[max(0, bisect.bisect_right(span_starts, t) - 1)]
+
+        # Readers of the layers that left the frame are stopped, and started again if a frame is asked for later
+        for layer in drawn:
+            if isinstance(layer, LazyVideoFileClip) and all(layer is not visible for visible in layers):
+                layer.close()
+
+        drawn[:] = layers
+
+        if layers and covers_frame(layers[0], size):
+            # Decoders hand out their last frame, so the bottom layer is copied before drawing on it
+            frame = np.array(layers[0].get_frame(t - layers[0].start), dtype=np.uint8)
+            layers = layers[1:]
+        else:
+            frame = background.copy()
+
+        for layer in layers:
+            frame = blit_in_place(frame, layer, t)
+
+        return frame
+
+    clip = VideoClip(make_frame, duration=duration)
+    fpss = [c.fps for c in clips if getattr(c, 'fps', None)]
+    clip.fps = max(fpss) if fpss else None
+
+    return clip
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from app import get_editor, create_pipeline, resolve_encoding, today_output_directory
+from pipeline import Pipeline
+from render import RenderFarm
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class Daemon:
+    def __init__(self, render_mode: Optional[str] = None):
+        self.render_mode = render_mode or os.getenv('RENDER_MODE', 'full')
+        self.render_farm = RenderFarm()
+        self.encoding: Optional[str] = None
+        self.pipelines: Dict[str, Pipeline] = {}
+        self.subscribers: Dict[str, List[asyncio.Queue]] = defaultdict(list)
+        # Every job runs in one task, whichever request started it and whether or not anyone still watches
+        self.running: Dict[str, asyncio.Task] = {}
+        self.eviction: Optional[asyncio.Task] = None
+
+    def pipeline(self) -> Pipeline:
+        # The clients, the render workers and the library indexes stay warm, only the output folder follows the date.
+        # Batches still running on yesterday's pipeline share its stage slots, so the limits hold across midnight
+        output_directory = today_output_directory()
+
+        if output_directory not in self.pipelines:
+            if self.pipelines:
+                pipeline = next(iter(self.pipelines.values())).with_output_directory(output_directory)
+            else:
+                pipeline = create_pipeline(output_directory, self.render_mode, self.render_farm, self.encoding)
+                pipeline.progress = self.publish
+                pipeline.evict_after_batch = False
+
+            self.pipelines = {output_directory: pipeline}
+
+        return self.pipelines[output_directory]
+
+    def start(self, pipeline: Pipeline, job_id: str, theme: str, finalize: bool) -> asyncio.Task:
+        if job_id not in self.running:
+            task = asyncio.create_task(pipeline.finalize([theme]) if finalize else pipeline.run([theme]))
+            task.add_done_callback(lambda _: self.finished(pipeline, job_id))
+            self.running[job_id] = task
+
+        return self.running[job_id]
+
+    def finished(self, pipeline: Pipeline, job_id: str):
+        self.running.pop(job_id, None)
+
+        # Stock files and cached artifacts are only evicted while no job can still be using them
+        if not self.running:
+            self.eviction = asyncio.create_task(self.evict(pipeline))
+
+    @staticmethod
+    async def evict(pipeline: Pipeline):
+        # A failed eviction only leaves files behind, it must not fail the requests that wait for it
+        try:
+            await asyncio.to_thread(pipeline.evict)
+        except Exception as e:
+            logger.error(f'Eviction failed: {e!r}')
+
+    def publish(self, event: dict):
+        for queue in self.subscribers.get(event['job_id'], []):
+            queue.put_nowait(event)
+
+    async def submit(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        themes = body.get('themes') or [body['theme']]
+        finalize = body.get('finalize', False)
+
+        pipeline = self.pipeline()
+        job_ids = [pipeline.jobs.job_id(theme) for theme in themes]
+
+        # New jobs wait for an eviction in progress, so it does not remove files they are about to use
+        if self.eviction is not None:
+            await self.eviction
+
+        queue = asyncio.Queue()
+        for job_id in job_ids:
+            self.subscribers[job_id].append(queue)
+
+        # A job that is already running is watched rather than started again
+        tasks = [self.start(pipeline, job_id, theme, finalize) for job_id, theme in zip(job_ids, themes)]
+
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+
+        async def send(event: dict):
+            await response.write((json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8'))
+
+        try:
+            await send({'event': 'accepted', 'jobs': dict(zip(job_ids, themes))})
+
+            while not all(task.done() for task in tasks) or not queue.empty():
+                next_event = asyncio.create_task(queue.get())
+                pending = {task for task in tasks if not task.done()}
+                done, _ = await asyncio.wait({next_event, *pending}, return_when=asyncio.FIRST_COMPLETED)
+
+                if next_event in done:
+                    await send(next_event.result())
+                else:
+                    next_event.cancel()
+
+            outputs = [task.result()[0] for task in tasks]
+            await send({'event': 'finished', 'outputs': dict(zip(themes, outputs))})
+        except ConnectionResetError:
+            logger.info('Client went away, the jobs keep running')
+        finally:
+            for job_id in job_ids:
+                self.subscribers[job_id].remove(queue)
+
+                if not self.subscribers[job_id]:
+                    del self.subscribers[job_id]
+
+        await response.write_eof()
+
+        return response
+
+    async def jobs(self, request: web.Request) -> web.Response:
+        return web.json_response([dict(row) for row in self.pipeline().jobs.jobs(request.query.get('status'))])
+
+    async def job(self, request: web.Request) -> web.Response:
+        jobs = self.pipeline().jobs
+        job = jobs.job(request.match_info['job_id'])
+
+        if job is None:
+            raise web.HTTPNotFound()
+
+        return web.json_response({**dict(job), 'stages': [dict(row) for row in jobs.stages(job['id'])]})
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'status': 'ok',
+            'render_mode': self.render_mode,
+            'render_workers': self.render_farm.workers,
+            'running_jobs': len(self.running),
+            'watched_jobs': len(self.subscribers),
+        })
+
+    async def export_traces(self):
+        # A long-running daemon writes its trace out every few minutes instead of holding every span in memory
+        while True:
+            await asyncio.sleep(float(os.getenv('DAEMON_TRACE_INTERVAL', 600)))
+
+            if tracer.events:
+                tracer.export(f'{today_output_directory()}/traces')
+                tracer.drain()
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post('/jobs', self.submit),
+            web.get('/jobs', self.jobs),
+            web.get('/jobs/{job_id}', self.job),
+            web.get('/health', self.health),
+        ])
+
+        return app
+
+    async def serve(self):
+        editor = get_editor()
+        editor.library.scan()
+        editor.music.scan()
+
+        self.encoding = await resolve_encoding()
+
+        runner = web.AppRunner(self.application())
+        await runner.setup()
+
+        socket_path = os.getenv('DAEMON_SOCKET')
+        if socket_path:
+            site = web.UnixSite(runner, socket_path)
+        else:
+            site = web.TCPSite(runner, os.getenv('DAEMON_HOST', '127.0.0.1'), int(os.getenv('DAEMON_PORT', 8765)))
+
+        await site.start()
+        logger.info(f'Listening on {site.name}')
+
+        exporter = asyncio.create_task(self.export_traces())
+
+        try:
+            await asyncio.Event().wait()
+        finally:
+            exporter.cancel()
+            await runner.cleanup()
+            self.render_farm.shutdown()
+
+            if tracer.events:
+                tracer.export(f'{today_output_directory()}/traces')
+
+
+if __name__ == '__main__':
+    asyncio.run(Daemon().serve())
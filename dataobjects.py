@@ -1,5 +1,6 @@
 import dataclasses
-from typing import Optional, List
+import os
+from typing import Optional, List, Tuple, Dict
 from decimal import Decimal
 
 @dataclasses.dataclass
@@ -114,3 +115,210 @@ class Scenario:
             full_scenario=d['full_scenario'],
             text_blocks=[ScenarioTextBlock.from_dict(block) for block in d['text_blocks']],
         )
+
+
+@dataclasses.dataclass(frozen=True)
+class EncodingProfile:
+    name: str
+    preset: str
+    crf: Optional[int] = None
+    bitrate: Optional[str] = None
+    threads: Optional[int] = None
+    pix_fmt: str = 'yuv420p'
+
+    def ffmpeg_params(self) -> List[str]:
+        # Everything but the codec and the preset, which moviepy's writer takes as arguments
+        params = ['-pix_fmt', self.pix_fmt]
+
+        if self.bitrate is not None:
+            params += ['-b:v', self.bitrate]
+        elif self.crf is not None:
+            params += ['-crf', f'{self.crf}']
+
+        if self.threads is not None:
+            params += ['-threads', f'{self.threads}']
+
+        return params
+
+    def ffmpeg_args(self) -> List[str]:
+        return ['-c:v', 'libx264', '-preset', self.preset, *self.ffmpeg_params()]
+
+
+# Ordered from the fastest to the best quality
+ENCODING_PROFILES = {
+    profile.name: profile for profile in [
+        EncodingProfile('draft', preset='ultrafast', crf=30),
+        EncodingProfile('production', preset='medium', crf=23),
+        EncodingProfile('archive', preset='slow', crf=18),
+    ]
+}
+
+
+def encoding_profile(name: str) -> EncodingProfile:
+    if name not in ENCODING_PROFILES:
+        raise Exception(f'Unknown encoding profile "{name}", expected one of {", ".join(ENCODING_PROFILES)}')
+
+    return ENCODING_PROFILES[name]
+
+
+@dataclasses.dataclass
+class RenderSettings:
+    frame_size: Tuple[int, int] = (1080, 1920)
+    fps: int = 24
+    preset: str = 'medium'
+    encoding: str = 'production'
+
+    @property
+    def scale(self) -> float:
+        # Caption layout is defined for the full 1080 pixel wide frame
+        return self.frame_size[0] / 1080
+
+    @staticmethod
+    def for_draft(draft: bool):
+        return DRAFT_RENDER if draft else FULL_RENDER
+
+
+FULL_RENDER = RenderSettings()
+DRAFT_RENDER = RenderSettings(frame_size=(540, 960), fps=12, preset='ultrafast', encoding='draft')
+
+
+@dataclasses.dataclass(frozen=True)
+class OutputTarget:
+    name: str
+    frame_size: Tuple[int, int]
+    # Overrides the rate control of the render's encoding profile, the preset stays the same
+    bitrate: Optional[str] = None
+
+    def profile(self, encoding: EncodingProfile) -> EncodingProfile:
+        return dataclasses.replace(encoding, bitrate=self.bitrate) if self.bitrate is not None else encoding
+
+    def output_path(self, output_path: str) -> str:
+        root, extension = os.path.splitext(output_path)
+
+        return f'{root}.{self.name}{extension}'
+
+
+OUTPUT_TARGETS = {
+    target.name: target for target in [
+        OutputTarget('vertical_hd', (1080, 1920), bitrate='8M'),
+        OutputTarget('vertical', (720, 1280)),
+        OutputTarget('square', (1080, 1080)),
+    ]
+}
+
+
+def output_target(name: str) -> OutputTarget:
+    if name not in OUTPUT_TARGETS:
+        raise Exception(f'Unknown output target "{name}", expected one of {", ".join(OUTPUT_TARGETS)}')
+
+    return OUTPUT_TARGETS[name]
+
+
+def target_paths(targets: List[OutputTarget], output_path: str) -> Dict[str, str]:
+    # The first target is written to output_path, the others next to it with their name in the file name
+    return {
+        target.name: output_path if i == 0 else target.output_path(output_path)
+        for i, target in enumerate(targets)
+    }
+
+
+@dataclasses.dataclass
+class StockClipSpec:
+    path: str
+    start: float
+    duration: float
+    video_id: Optional[str] = None
+    url: Optional[str] = None
+
+    def to_json(self):
+        return {
+            "path": self.path,
+            "start": self.start,
+            "duration": self.duration,
+            "video_id": self.video_id,
+            "url": self.url,
+        }
+
+    @staticmethod
+    def from_dict(d: dict):
+        return StockClipSpec(
+            path=d['path'],
+            start=d['start'],
+            duration=d['duration'],
+            video_id=d.get('video_id'),
+            url=d.get('url'),
+        )
+
+
+@dataclasses.dataclass
+class RenderSpec:
+    scenario: Scenario
+    stock_clips: List[StockClipSpec]
+    narration_path: str
+    music_path: str
+    output_path: str
+    draft: bool = False
+    encoding: Optional[str] = None
+    audio_path: Optional[str] = None
+    targets: Optional[List[str]] = None
+
+    def profile(self) -> EncodingProfile:
+        return encoding_profile(self.encoding or RenderSettings.for_draft(self.draft).encoding)
+
+    def output_targets(self) -> List[OutputTarget]:
+        return [output_target(name) for name in self.targets or []]
+
+    def target_paths(self) -> Dict[str, str]:
+        return target_paths(self.output_targets(), self.output_path)
+
+    def to_json(self):
+        return {
+            "scenario": self.scenario.to_json(),
+            "lines": [line.to_json() for line in (self.scenario.lines or [])],
+            "stock_clips": [clip.to_json() for clip in self.stock_clips],
+            "narration_path": self.narration_path,
+            "music_path": self.music_path,
+            "output_path": self.output_path,
+            "draft": self.draft,
+            "encoding": self.encoding,
+            "audio_path": self.audio_path,
+            "targets": self.targets,
+        }
+
+    @staticmethod
+    def from_dict(d: dict):
+        scenario = Scenario.from_dict(d['scenario'])
+        scenario.lines = [TextLine.from_dict(line) for line in d['lines']]
+        scenario.narration_path = d['narration_path']
+
+        return RenderSpec(
+            scenario=scenario,
+            stock_clips=[StockClipSpec.from_dict(clip) for clip in d['stock_clips']],
+            narration_path=d['narration_path'],
+            music_path=d['music_path'],
+            output_path=d['output_path'],
+            draft=d.get('draft', False),
+            encoding=d.get('encoding'),
+            audio_path=d.get('audio_path'),
+            targets=d.get('targets'),
+        )
+
+
+@dataclasses.dataclass
+class AudioMixSettings:
+    music_volume: float = 0.08
+    # How far the music goes down under speech, 0 keeps it at a constant level
+    duck_db: float = 0.0
+    speech_threshold_db: float = -40.0
+    window_seconds: float = 0.05
+    smoothing_seconds: float = 0.3
+
+    @staticmethod
+    def from_env():
+        defaults = AudioMixSettings()
+
+        return AudioMixSettings(
+            music_volume=float(os.getenv('MUSIC_VOLUME', defaults.music_volume)),
+            duck_db=float(os.getenv('MUSIC_DUCK_DB', defaults.duck_db)),
+            speech_threshold_db=float(os.getenv('MUSIC_DUCK_THRESHOLD_DB', defaults.speech_threshold_db)),
+        )
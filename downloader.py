@@ -0,0 +1,93 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import retry, stop_after_attempt, wait_fixed
+
+logger = logging.getLogger(__name__)
+
+
+class Downloader:
+    chunk_size = 1024 * 1024
+
+    def __init__(self, concurrency: Optional[int] = None):
+        self.concurrency = concurrency or int(os.getenv('DOWNLOAD_CONCURRENCY', 4))
+
+        # One connection pool for every download, so repeated hosts reuse their connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # Shared by every caller, so concurrent batches together stay under the limit
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+        self.path_locks = {}
+        self.path_locks_guard = threading.Lock()
+
+    def path_lock(self, path: str) -> threading.Lock:
+        with self.path_locks_guard:
+            return self.path_locks.setdefault(path, threading.Lock())
+
+    def download(self, url: str, path: str) -> str:
+        # Two themes picking the same video must not write into the same partial file
+        with self.path_lock(path), self.slots:
+            return self.download_to_path(url, path)
+
+    @retry(stop=stop_after_attempt(5), wait=wait_fixed(2))
+    def download_to_path(self, url: str, path: str) -> str:
+        if os.path.exists(path):
+            return path
+
+        # The partial file survives failed attempts and crashes, and the next attempt continues from its end
+        part_path = f'{path}.part'
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        with self.session.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+            if response.status_code == 416:
+                # The previous attempt already received everything
+                os.replace(part_path, path)
+
+                return path
+
+            if response.status_code not in (200, 206):
+                raise Exception(f"Failed to download video from {url}: {response.status_code}")
+
+            if response.status_code == 200 and offset:
+                logger.info(f'{url} does not support ranges, restarting the download')
+                offset = 0
+
+            expected_size = self.expected_size(response, offset)
+
+            with open(part_path, 'ab' if offset else 'wb') as file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    file.write(chunk)
+
+        if expected_size is not None and os.path.getsize(part_path) != expected_size:
+            raise Exception(f"Incomplete download of {url}: {os.path.getsize(part_path)} of {expected_size} bytes")
+
+        os.replace(part_path, path)
+
+        return path
+
+    @staticmethod
+    def expected_size(response: requests.Response, offset: int) -> Optional[int]:
+        content_range = response.headers.get('Content-Range')
+
+        if content_range and '/' in content_range and not content_range.endswith('/*'):
+            return int(content_range.split('/')[-1])
+
+        content_length = response.headers.get('Content-Length')
+
+        if content_length is not None:
+            return offset + int(content_length) if response.status_code == 206 else int(content_length)
+
+        return None
+
+    def download_many(self, downloads: List[Tuple[str, str]]) -> List[str]:
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(lambda download: self.download(*download), downloads))
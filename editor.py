@@ -1,40 +1,149 @@
+import asyncio
+import dataclasses
 import json
 import logging
 import os
 import random
+import sqlite3
+import tempfile
+import threading
+import time
 import uuid
+from collections import OrderedDict
 from decimal import Decimal
 
-from tenacity import retry, stop_after_attempt, wait_fixed, wait_incrementing
+from tenacity import retry, stop_after_attempt, wait_incrementing
 
+import numpy as np
 import moviepy.editor as mp
 from moviepy.audio.fx.volumex import volumex
-from moviepy.video.VideoClip import TextClip, ColorClip
-from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+from moviepy.video.VideoClip import ColorClip
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
 import requests
-from typing import List
+from typing import List, Tuple, Optional
 
 from moviepy.video.fx.crop import crop
 from termcolor import colored
 
+from downloader import Downloader
+from music_library import MusicLibrary
+from profiler import RenderProfiler
+from stock_library import StockLibrary, ORIGINAL, TRIMMED, NORMALIZED
+from captions import rasterize_word, caption_line_clip, write_caption_track, Placement, Highlight
+from compositor import composite_layers, LazyVideoFileClip
 from Openai import SystemMessage, OpenAIChat, ModelConfig, AssistantMessage
-from dataobjects import Scenario, TextLine, TranscriptionWord, ScenarioTextBlock
+from tracing import traced, tracer
+from transcode import normalize_video, run_ffmpeg, compose_args, media_duration, split_args, open_ffmpeg
+from dataobjects import Scenario, TextLine, TranscriptionWord, ScenarioTextBlock, StockClipSpec, RenderSpec, \
+    RenderSettings, FULL_RENDER, EncodingProfile, encoding_profile, OutputTarget, target_paths
+
+# Bumped whenever the compositing or the caption layout and drawing change what a render looks like,
+# so renders cached by an older version are not handed out
+RENDER_VERSION = 1
 
 
 class Editor:
     used_videos = {}
     files_folder = 'stock_videos'
 
-    @retry(stop=stop_after_attempt(5), wait=wait_fixed(2))
-    def download_video(self, url, video_path):
-        response = requests.get(url)
-        if response.status_code == 200:
-            with open(video_path, "wb") as file:
-                file.write(response.content)
-        else:
-            raise Exception(f"Failed to download video from {url}")
+    def __init__(self):
+        self.trim_backend = os.getenv('TRIM_BACKEND', 'ffmpeg')
+        self.compose_backend = os.getenv('COMPOSE_BACKEND', 'ffmpeg')
+        self.downloader = Downloader()
+        self.library = StockLibrary(self.files_folder)
+        self.music = MusicLibrary(os.path.join(os.path.dirname(__file__), 'songs'))
+        self.normalized_length = float(os.getenv('NORMALIZED_CLIP_SECONDS', 15))
+        # Share of moviepy renders that write a per-layer profile next to the video, from 0 to 1
+        self.profile_sample = float(os.getenv('RENDER_PROFILE_SAMPLE', 0))
 
-    def download_and_trim_video(self, stock_video: dict, duration: float, target_dimensions: tuple[int, int]) -> str:
+    @traced()
+    def download_video(self, url, video_path, video_id):
+        self.downloader.download(url, video_path)
+        self.library.add(video_path, ORIGINAL, video_id, source_url=url)
+
+    def download_videos(self, stock_videos: List[dict]):
+        downloads = {}
+
+        for stock_video in stock_videos:
+            if not self.library.has_original(stock_video['id']):
+                _, video_path = self.stock_video_paths(stock_video)
+                downloads[video_path] = stock_video
+
+        with tracer.span('Editor.download_videos'):
+            self.downloader.download_many([(stock_video['url'], video_path) for video_path, stock_video in downloads.items()])
+
+        for video_path, stock_video in downloads.items():
+            self.library.add(video_path, ORIGINAL, stock_video['id'], source_url=stock_video['url'])
+
+    def prepare_stock_video(self, stock_video: dict, duration: float, settings: RenderSettings = FULL_RENDER) -> str:
+        if self.trim_backend == 'moviepy':
+            return self.download_and_trim_video(stock_video, duration, settings.frame_size)
+
+        return self.download_and_normalize_video(stock_video, duration, settings.frame_size, settings)
+
+    def is_prepared(self, stock_video: dict, duration: float, settings: RenderSettings = FULL_RENDER) -> bool:
+        if self.trim_backend == 'moviepy':
+            return self.library.trimmed(stock_video['id'], duration, settings.frame_size[1]) is not None
+
+        return self.library.normalized(stock_video['id'], duration, settings.frame_size[1]) is not None
+
+    @traced()
+    def download_and_normalize_video(
+        self,
+        stock_video: dict,
+        duration: float,
+        target_dimensions: tuple[int, int],
+        settings: RenderSettings = FULL_RENDER,
+    ) -> str:
+        url = stock_video['url']
+        video_id = stock_video['id']
+        _, video_path = self.stock_video_paths(stock_video)
+
+        # One intermediate per source and size serves every block duration up to the normalized length
+        normalized = self.library.normalized(video_id, duration, target_dimensions[1])
+        if normalized is not None:
+            return normalized['path']
+
+        original = self.library.original(video_id)
+        if original is None:
+            self.download_video(url, video_path, video_id)
+            original = self.library.original(video_id)
+
+        # A source shorter than the normalized length only covers its own duration, and is recorded as such
+        normalized_length = max(duration, self.normalized_length)
+        covered_length = min(normalized_length, original['duration'] or normalized_length)
+
+        if covered_length < duration:
+            normalized = self.library.normalized(video_id, covered_length, target_dimensions[1])
+            if normalized is not None:
+                return normalized['path']
+
+        normalized_path = f'{self.files_folder}/normalized_{video_id}.mp4'
+
+        if target_dimensions != FULL_RENDER.frame_size:
+            normalized_path = f'{self.files_folder}/normalized_{video_id}_{target_dimensions[0]}x{target_dimensions[1]}.mp4'
+
+        normalize_video(
+            original['path'],
+            normalized_path,
+            normalized_length,
+            target_dimensions,
+            fps=settings.fps,
+            preset=settings.preset,
+        )
+
+        self.library.add(
+            normalized_path,
+            NORMALIZED,
+            video_id,
+            source_url=url,
+            source_path=original['path'],
+            requested_duration=covered_length,
+        )
+
+        return normalized_path
+
+    def stock_video_paths(self, stock_video: dict) -> Tuple[str, str]:
         url = stock_video['url']
         video_id = stock_video['id']
 
@@ -42,41 +151,69 @@ class Editor:
         video_filename = f'{video_id}.{video_extension}'
         video_path = f'{self.files_folder}/{video_filename}'
 
-        trimmed_path = f'{self.files_folder}/trimmed_{duration}_{video_filename}'
+        return video_filename, video_path
 
-        if os.path.exists(trimmed_path):
-            return trimmed_path
-
-        if not os.path.exists(video_path):
-            self.download_video(url, video_path)
+    @traced()
+    def download_and_trim_video(self, stock_video: dict, duration: float, target_dimensions: tuple[int, int]) -> str:
+        url = stock_video['url']
+        video_id = stock_video['id']
+        video_filename, video_path = self.stock_video_paths(stock_video)
+
+        trimmed = self.library.trimmed(video_id, duration, target_dimensions[1])
+        if trimmed is not None:
+            return trimmed['path']
+
+        original = self.library.original(video_id)
+        if original is None:
+            self.download_video(url, video_path, video_id)
+            original = self.library.original(video_id)
+
+        # The ffmpeg backend normalizes instead, so only moviepy trims are made here
+        trimmed_path = self.trim_video_moviepy(original, video_filename, duration, target_dimensions)
+
+        self.library.add(
+            trimmed_path,
+            TRIMMED,
+            video_id,
+            source_url=url,
+            source_path=original['path'],
+            requested_duration=duration,
+        )
 
-        # Load the video
-        video_clip = mp.VideoFileClip(video_path)
+        return trimmed_path
 
+    def trim_video_moviepy(
+        self,
+        original: sqlite3.Row,
+        video_filename: str,
+        duration: float,
+        target_dimensions: tuple[int, int]
+    ) -> str:
         # Adjust start_time and end_time to be within the video's duration
-        video_duration = video_clip.duration
         start_time = 0
-        end_time = min(duration, video_duration)
+        end_time = min(duration, original['duration'] or duration)
 
-        trimmed_filename = f'trimmed_{end_time}_{video_filename}'
+        # Drafts and full renders trim the same source to different sizes, so the size is part of the name
+        trimmed_filename = f'trimmed_{end_time}_{target_dimensions[0]}x{target_dimensions[1]}_{video_filename}'
         trimmed_path = f'{self.files_folder}/{trimmed_filename}'
 
         if os.path.exists(trimmed_path):
             return trimmed_path
 
         # Load and trim the video
-        video_clip = (
-            mp.VideoFileClip(video_path)
-            .subclip(start_time, end_time)
-            .resize(newsize=target_dimensions)
-        )
+        source_clip = mp.VideoFileClip(original['path'])
+
+        try:
+            video_clip = source_clip.subclip(start_time, end_time).resize(newsize=target_dimensions)
 
-        # Resize and crop the video to the target dimensions
-        video_clip = crop(video_clip, width=target_dimensions[0], height=target_dimensions[1],
-                          x_center=video_clip.w / 2, y_center=video_clip.h / 2)
+            # Resize and crop the video to the target dimensions
+            video_clip = crop(video_clip, width=target_dimensions[0], height=target_dimensions[1],
+                              x_center=video_clip.w / 2, y_center=video_clip.h / 2)
 
-        # Save the trimmed video
-        video_clip.write_videofile(trimmed_path, codec="libx264")
+            # Save the trimmed video
+            video_clip.write_videofile(trimmed_path, codec="libx264")
+        finally:
+            source_clip.close()
 
         return trimmed_path
 
@@ -84,6 +221,9 @@ class Editor:
         shuffled_ids = list(block.stock_video_urls.keys())
         random.shuffle(shuffled_ids)
 
+        # Candidates that were already prefetched go first
+        shuffled_ids.sort(key=lambda video_id: not self.library.has_original(video_id))
+
         for video_id in shuffled_ids:
             if video_id not in self.used_videos:
                 self.used_videos[video_id] = True
@@ -94,17 +234,29 @@ class Editor:
         random_id = random.choice(shuffled_ids)
         return {'id': random_id, 'url': block.stock_video_urls[random_id]}
 
-    def get_subtitles_clips(self, scenario: Scenario) -> List[TextClip]:
-        frame_size = (1080, 1920)
+    def prefetch_candidates(self, scenario: Scenario, per_block: int) -> List[dict]:
+        candidates = []
+
+        for block in scenario.text_blocks:
+            # Pexels returns the most relevant videos first
+            for video_id, url in list((block.stock_video_urls or {}).items())[:per_block]:
+                candidates.append({'id': video_id, 'url': url})
+
+        return candidates
+
+    @traced()
+    def get_subtitles_clips(self, scenario: Scenario, settings: RenderSettings = FULL_RENDER) -> List[mp.VideoClip]:
         captions = []
 
         for i, line in enumerate(scenario.lines):
-            captions.extend(self.create_caption(line, frame_size))
+            captions.append(self.create_caption(line, settings.frame_size, settings.scale))
 
         return captions
 
-    def get_stock_video_clips(self, scenario: Scenario) -> List[mp.VideoClip]:
-        stock_clips = []
+    @traced()
+    def prepare_stock_video_clips(self, scenario: Scenario, draft: bool = False) -> List[StockClipSpec]:
+        settings = RenderSettings.for_draft(draft)
+        timeline = []
 
         start_time = 0
         for i, block in enumerate(scenario.text_blocks):
@@ -125,64 +277,300 @@ class Editor:
             if duration <= 0:
                 raise Exception(f"Duration is less than 0: {duration}. {next_block_start_time, start_time}")
 
-            trimmed_video_path = self.download_and_trim_video(
+            timeline.append((stock_video, start_time, duration))
+
+            start_time = next_block_start_time
+
+        # Fetch every source that still has to be trimmed at once, under the downloader's limit
+        self.download_videos([
+            stock_video for stock_video, _, duration in timeline
+            if not self.is_prepared(stock_video, duration, settings)
+        ])
+
+        stock_clips = []
+        for stock_video, start_time, duration in timeline:
+            # The clip spec cuts the block's duration out of the prepared file at compose time
+            prepared_video_path = self.prepare_stock_video(
                 stock_video,
                 duration,
-                (1080, 1920)
+                settings
             )
 
-            video_clip = (
-                mp.VideoFileClip(trimmed_video_path)
-                .set_start(start_time)
-                .set_duration(duration)
+            stock_clips.append(StockClipSpec(
+                path=prepared_video_path,
+                start=start_time,
+                duration=duration,
+                video_id=str(stock_video['id']),
+                url=stock_video['url'],
+            ))
+
+        return stock_clips
+
+    def full_quality_spec(self, spec: RenderSpec, output_path: str) -> RenderSpec:
+        # The draft's timeline is kept as is, only its clips are prepared again at full size
+        stock_clips = [
+            StockClipSpec(
+                path=self.prepare_stock_video({'id': clip.video_id, 'url': clip.url}, clip.duration, FULL_RENDER),
+                start=clip.start,
+                duration=clip.duration,
+                video_id=clip.video_id,
+                url=clip.url,
             )
+            for clip in spec.stock_clips
+        ]
 
-            stock_clips.append(video_clip)
+        return dataclasses.replace(spec, stock_clips=stock_clips, output_path=output_path, draft=False)
 
-            start_time = next_block_start_time
+    @traced()
+    def get_stock_video_clips(
+        self,
+        stock_clips: List[StockClipSpec],
+        frame_size: tuple[int, int] = (1080, 1920)
+    ) -> List[mp.VideoClip]:
+        # Readers are only started when the render reaches a clip and stopped once it has passed
+        return [
+            LazyVideoFileClip(clip.path, frame_size, clip.duration).set_start(clip.start)
+            for clip in stock_clips
+        ]
 
-        return stock_clips
+    def select_background_music(self, min_duration: Optional[float] = None) -> str:
+        # Select a random song from the 'songs' folder, long enough to play under the whole narration
+        if not self.music.songs():
+            self.music.scan()
+
+        return self.music.select(min_duration)['path']
 
     def get_background_music(self) -> mp.AudioClip:
-        # Select a random song from the 'songs' folder
-        songs_folder = os.path.join(os.path.dirname(__file__), 'songs')
-        song_files = [f for f in os.listdir(songs_folder) if f.endswith('.m4a') or f.endswith('.mp3')]
-        random_song_path = os.path.join(songs_folder, random.choice(song_files))
+        return mp.AudioFileClip(self.select_background_music())
+
+    def render_cache_inputs(self, spec: RenderSpec) -> dict:
+        return {
+            'version': RENDER_VERSION,
+            'compose_backend': 'moviepy' if spec.targets else self.compose_backend,
+            'caption_font': os.getenv('CAPTION_FONT_PATH'),
+        }
+
+    @traced()
+    def render(self, spec: RenderSpec) -> str:
+        # The ffmpeg backend writes a single output, several targets are composited once in moviepy and split.
+        # Its failures are raised rather than hidden behind a second, slower render; COMPOSE_BACKEND=moviepy
+        # is the switch for an ffmpeg that cannot run the filter graph
+        if self.compose_backend == 'ffmpeg' and not spec.targets:
+            return self.compose_video_ffmpeg(spec)
+
+        settings = RenderSettings.for_draft(spec.draft)
+        subtitles_clips = self.get_subtitles_clips(spec.scenario, settings)
+        stock_video_clips = self.get_stock_video_clips(spec.stock_clips, settings.frame_size)
+        background_music = mp.AudioFileClip(spec.music_path) if spec.audio_path is None else None
+
+        self.compose_video(
+            subtitles_clips,
+            stock_video_clips,
+            background_music,
+            spec.narration_path,
+            spec.output_path,
+            settings,
+            spec.profile(),
+            spec.audio_path,
+            targets=spec.output_targets() or None
+        )
 
-        return mp.AudioFileClip(random_song_path)
+        return spec.output_path
 
+    @traced()
     def compose_video(
         self,
-        subtitles_clips: List[TextClip],
+        subtitles_clips: List[mp.VideoClip],
         stock_video_clips: List[mp.VideoClip],
         background_music: mp.AudioClip,
         narration_path: str,
-        output_path: str
+        output_path: str,
+        settings: RenderSettings = FULL_RENDER,
+        encoding: Optional[EncodingProfile] = None,
+        audio_path: Optional[str] = None,
+        profiled: Optional[bool] = None,
+        targets: Optional[List[OutputTarget]] = None
     ):
-        frame_size = (1080, 1920)
+        encoding = encoding or encoding_profile(settings.encoding)
+        frame_size = settings.frame_size
 
-        # Load the input audio (voiceover)
-        input_audio = mp.AudioFileClip(narration_path)
+        if profiled is None:
+            profiled = random.random() < self.profile_sample
+        profiler = RenderProfiler() if profiled else None
 
-        # Load the background music and set its volume lower than the voiceover
-        background_music = volumex(background_music, 0.08)
-        background_music = background_music.subclip(0, min(input_audio.duration, background_music.duration))
+        if audio_path is not None:
+            # The premixed track is copied into the video as it is
+            duration = media_duration(narration_path)
+            combined_audio = None
+        else:
+            # Load the input audio (voiceover)
+            input_audio = mp.AudioFileClip(narration_path)
+            duration = input_audio.duration
+
+            # Load the background music and set its volume lower than the voiceover
+            background_music = volumex(background_music, 0.08)
+            background_music = background_music.subclip(0, min(input_audio.duration, background_music.duration))
 
-        # Combine the voiceover and background music
-        combined_audio = mp.CompositeAudioClip([input_audio, background_music])
+            # Combine the voiceover and background music
+            combined_audio = mp.CompositeAudioClip([input_audio, background_music])
 
         # Create a black background clip with the given frame size and duration
-        background_clip = ColorClip(size=frame_size, color=(0, 0, 0)).set_duration(input_audio.duration)
+        background_clip = ColorClip(size=frame_size, color=(0, 0, 0)).set_duration(duration)
+
+        if profiler is not None:
+            profiler.layer(background_clip, 'background', 'background')
+
+            for i, clip in enumerate(stock_video_clips):
+                path = clip.reader.path if isinstance(clip, LazyVideoFileClip) else getattr(clip, 'filename', '')
+                profiler.layer(clip, f'stock {i} {os.path.basename(path)} at {clip.start:.2f}s', 'stock')
+
+            for i, clip in enumerate(subtitles_clips):
+                profiler.layer(clip, f'caption {i} at {clip.start:.2f}s', 'caption')
 
-        # Combine the background clip and subtitles
-        final_video = CompositeVideoClip([background_clip] + stock_video_clips + subtitles_clips)
+        # Combine the background clip and subtitles, leaving out whatever the stock footage covers
+        final_video = composite_layers([background_clip] + stock_video_clips + subtitles_clips, frame_size)
 
         # Set the audio of the final video to be the combined audio
-        final_video = final_video.set_audio(combined_audio)
+        if combined_audio is not None:
+            final_video = final_video.set_audio(combined_audio)
+
+        if profiler is not None:
+            profiler.output(final_video)
+            profiler.start()
 
         # Save the final video
-        final_video.write_videofile(output_path, fps=24, codec="libx264", audio_codec="aac")
+        try:
+            with tracer.span('Editor.compose_video.encode'):
+                if targets:
+                    self.write_targets(final_video, duration, settings, encoding, targets, output_path, audio_path)
+                else:
+                    final_video.write_videofile(
+                        output_path,
+                        fps=settings.fps,
+                        codec="libx264",
+                        audio_codec="aac",
+                        preset=encoding.preset,
+                        ffmpeg_params=encoding.ffmpeg_params(),
+                        audio=audio_path if audio_path is not None else True
+                    )
+
+            if profiler is not None:
+                profiler.stop()
+                profiler.write(output_path)
+        finally:
+            # Readers still open at the end of the render are stopped, so a worker does not collect them
+            for clip in stock_video_clips:
+                clip.close()
+
+            if combined_audio is not None:
+                input_audio.close()
+                background_music.close()
+
+
+    @staticmethod
+    def write_targets(
+        video: mp.VideoClip,
+        duration: float,
+        settings: RenderSettings,
+        encoding: EncodingProfile,
+        targets: List[OutputTarget],
+        output_path: str,
+        audio_path: Optional[str] = None
+    ):
+        with tempfile.TemporaryDirectory() as audio_directory:
+            if audio_path is None and video.audio is not None:
+                # Every target copies the same track, so the moviepy mix is encoded once up front
+                audio_path = f'{audio_directory}/audio.m4a'
+                video.audio.write_audiofile(audio_path, fps=44100, codec='aac', logger=None)
+
+            outputs = list(zip(targets, target_paths(targets, output_path).values()))
+            process = open_ffmpeg(split_args(settings.frame_size, settings.fps, outputs, encoding, audio_path))
+
+            try:
+                # Frames are composited once and fanned out by ffmpeg, on the same time grid as write_videofile
+                for t in np.arange(0, duration, 1.0 / settings.fps):
+                    process.stdin.write(np.asarray(video.get_frame(t), dtype=np.uint8).tobytes())
+            except BrokenPipeError:
+                # ffmpeg stopped reading, its error output below says why
+                pass
+            except BaseException:
+                process.kill()
+                process.wait()
+
+                raise
+
+            _, stderr = process.communicate()
+
+        if process.returncode != 0:
+            raise Exception(f'ffmpeg failed ({process.returncode}): {stderr.decode(errors="replace")}')
+
+    @traced()
+    def render_segment(self, spec: RenderSpec, start_frame: int, end_frame: int, output_path: str) -> str:
+        settings = RenderSettings.for_draft(spec.draft)
+        start, end = start_frame / settings.fps, end_frame / settings.fps
+
+        # Only the stock clips that show up in this segment are opened
+        stock_clips = [clip for clip in spec.stock_clips if clip.start < end and clip.start + clip.duration > start]
+
+        background_clip = ColorClip(size=settings.frame_size, color=(0, 0, 0))
+        background_clip = background_clip.set_duration(media_duration(spec.narration_path))
+        stock_video_clips = self.get_stock_video_clips(stock_clips, settings.frame_size)
+        video = composite_layers(
+            [background_clip] + stock_video_clips + self.get_subtitles_clips(spec.scenario, settings),
+            settings.frame_size
+        )
+
+        # Frames are taken on the same grid as a whole render, so the segments join without a seam
+        encoding = spec.profile()
+        writer = FFMPEG_VideoWriter(
+            output_path,
+            settings.frame_size,
+            settings.fps,
+            preset=encoding.preset,
+            ffmpeg_params=encoding.ffmpeg_params()
+        )
 
+        try:
+            with tracer.span('Editor.render_segment.encode', frames=end_frame - start_frame):
+                for frame_index in range(start_frame, end_frame):
+                    writer.write_frame(video.get_frame(frame_index / settings.fps))
+        finally:
+            writer.close()
+
+            for clip in stock_video_clips:
+                clip.close()
+
+        return output_path
+
+    @traced()
+    def compose_video_ffmpeg(self, spec: RenderSpec) -> str:
+        settings = RenderSettings.for_draft(spec.draft)
+        frame_size = settings.frame_size
+        duration = media_duration(spec.narration_path)
+
+        with tempfile.TemporaryDirectory() as captions_directory:
+            lines = [
+                (*self.layout_caption(line, frame_size, settings.scale), line.start, line.end)
+                for line in spec.scenario.lines
+            ]
+            captions_playlist_path = write_caption_track(lines, frame_size, duration, captions_directory)
+
+            # Stock footage, captions and the audio mix go through one decode and one encode
+            with tracer.span('Editor.compose_video_ffmpeg.encode'):
+                run_ffmpeg(compose_args(
+                    spec.stock_clips,
+                    captions_playlist_path,
+                    spec.narration_path,
+                    spec.music_path,
+                    duration,
+                    spec.output_path,
+                    frame_size=frame_size,
+                    fps=settings.fps,
+                    encoding=spec.profile(),
+                    audio_path=spec.audio_path,
+                ))
+
+        return spec.output_path
 
     @staticmethod
     def _text_line_from_words(words: List[TranscriptionWord]) -> TextLine:
@@ -230,71 +618,56 @@ class Editor:
 
         return scenario
 
-    def create_caption(
-        self,
+    def create_caption(self, text_json: TextLine, frame_size, scale: float = 1.0) -> mp.VideoClip:
+        placements, highlights = self.layout_caption(text_json, frame_size, scale)
+
+        # One layer per line: the highlighted word is baked into precomputed overlays
+        return caption_line_clip(placements, highlights, text_json.start, text_json.end)
+
+    @staticmethod
+    def layout_caption(
         text_json: TextLine,
         frame_size,
+        scale: float = 1.0,
         font="Helvetica-Bold",
         fontsize=70,
         color='white',
         bgcolor='blue'
-    ) -> List[TextClip]:
-        full_duration = text_json.end - text_json.start
-
-        word_clips = []
-        xy_textclips_positions = []
+    ) -> Tuple[List[Placement], List[Highlight]]:
+        placements = []
+        highlights = []
 
         frame_width, frame_height = frame_size
-        x_buffer = frame_width / 10
-        y_buffer = frame_height / 5
+        x_buffer = frame_width // 10
+        y_buffer = frame_height // 5
+
+        # Draft renders are laid out the same way on a smaller frame
+        fontsize = round(fontsize * scale)
+        line_spacing = round(20 * scale)
 
         x_pos = 0
-        y_pos = 600
+        y_pos = round(600 * scale)
 
         for index, word_json in enumerate(text_json.words):
-            duration = word_json.end - word_json.start
-            word_clip = TextClip(
-                word_json.word + ' ',
-                font=font,
-                fontsize=fontsize,
-                bg_color='black',
-                color=color,
-            ).set_start(text_json.start).set_duration(full_duration)
-            word_width, word_height = word_clip.size
+            word_raster = rasterize_word(word_json.word + ' ', font, fontsize, color, 'black')
+            word_height, word_width = word_raster.shape[:2]
 
             if x_pos + word_width > frame_width - 2 * x_buffer:
                 x_pos = 0
-                y_pos += word_height + 20
-
-            xy_textclips_positions.append({
-                "x_pos": x_pos + x_buffer,
-                "y_pos": y_pos + y_buffer,
-                "width": word_width,
-                "height": word_height,
-                "word": word_json.word,
-                "start": word_json.start,
-                "end": word_json.end,
-                "duration": duration
-            })
-
-            word_clip = word_clip.set_position((x_pos + x_buffer, y_pos + y_buffer))
-            x_pos += word_width
-
-            word_clips.append(word_clip)
+                y_pos += word_height + line_spacing
 
-        for highlight_word in xy_textclips_positions:
-            word_clip_highlight = TextClip(
-                highlight_word['word'],
-                font=font,
-                fontsize=fontsize,
-                color=color,
-                bg_color=bgcolor,
-            ).set_start(highlight_word['start']).set_duration(highlight_word['duration'])
+            placements.append((word_raster, x_pos + x_buffer, y_pos + y_buffer))
+            highlights.append((
+                rasterize_word(word_json.word, font, fontsize, color, bgcolor),
+                x_pos + x_buffer,
+                y_pos + y_buffer,
+                word_json.start,
+                word_json.end,
+            ))
 
-            word_clip_highlight = word_clip_highlight.set_position((highlight_word['x_pos'], highlight_word['y_pos']))
-            word_clips.append(word_clip_highlight)
+            x_pos += word_width
 
-        return word_clips
+        return placements, highlights
 
 
 class StockFinder:
@@ -307,6 +680,14 @@ class StockFinder:
             config=ModelConfig(temperature=0.3),
         )
 
+        # Searches are shared by the prefetch and candidate stages of every batch the process runs,
+        # so the oldest are dropped past a size and any is searched again once it is stale
+        self.search_results = OrderedDict()
+        self.search_results_lock = threading.Lock()
+        self.search_cache_size = int(os.getenv('PEXELS_SEARCH_CACHE_SIZE', 256))
+        self.search_cache_seconds = float(os.getenv('PEXELS_SEARCH_CACHE_SECONDS', 3600))
+
+    @traced()
     async def get_keywords(self, paragraph: str) -> str:
         system_message = SystemMessage(
             'You are a talented ENGLISH keywords maker. ' 
@@ -329,6 +710,31 @@ class StockFinder:
 
         return result.ok().content
 
+    def search(self, query: str, per_page: int) -> dict:
+        # The prefetch stage and the candidate stage search for the same keywords
+        key = (query, per_page)
+
+        with self.search_results_lock:
+            cached = self.search_results.get(key)
+
+            if cached is not None and time.monotonic() - cached[0] < self.search_cache_seconds:
+                self.search_results.move_to_end(key)
+
+                return cached[1]
+
+        # The request runs outside the lock, so searches for other keywords are not held up by it
+        result = self.search_pexels(query, per_page)
+
+        with self.search_results_lock:
+            self.search_results[key] = (time.monotonic(), result)
+            self.search_results.move_to_end(key)
+
+            while len(self.search_results) > self.search_cache_size:
+                self.search_results.popitem(last=False)
+
+        return result
+
+    @traced()
     @retry(stop=stop_after_attempt(5), wait=wait_incrementing(10, 10, 60))
     def search_pexels(self, query: str, per_page: int) -> dict:
         headers = {
@@ -353,6 +759,7 @@ class StockFinder:
 
         return response.json()
 
+    @traced()
     async def add_stock_video_candidates(
         self,
         scenario: Scenario
@@ -365,7 +772,7 @@ class StockFinder:
             video_urls = {}
 
             for keyword in block.keywords:
-                response = self.search_pexels(keyword, per_page)
+                response = await asyncio.to_thread(self.search, keyword, per_page)
 
                 if 'videos' not in response:
                     print(response)
@@ -377,7 +784,7 @@ class StockFinder:
                     for single_keyword in keyword.split():
                         print(colored(f"Searching for: {single_keyword}", "cyan"))
 
-                        response = self.search_pexels(single_keyword, per_page)
+                        response = await asyncio.to_thread(self.search, single_keyword, per_page)
 
                         if len(response["videos"]) != 0:
                             break
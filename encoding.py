@@ -0,0 +1,89 @@
+import dataclasses
+import json
+import logging
+import os
+import platform
+import time
+from typing import Optional, Dict
+
+from cache import ArtifactCache
+from dataobjects import EncodingProfile, ENCODING_PROFILES, FULL_RENDER, RenderSettings
+from transcode import run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+
+def benchmark_profile(profile: EncodingProfile, settings: RenderSettings = FULL_RENDER, sample_seconds: float = 5) -> float:
+    # A synthetic sample with motion all over the frame, encoded and thrown away
+    started = time.perf_counter()
+    run_ffmpeg([
+        '-f', 'lavfi',
+        '-i', f'testsrc2=size={settings.frame_size[0]}x{settings.frame_size[1]}:rate={settings.fps}:duration={sample_seconds}',
+        *profile.ffmpeg_args(),
+        '-f', 'null', '-',
+    ])
+
+    # Seconds of encoding per minute of output
+    return (time.perf_counter() - started) / sample_seconds * 60
+
+
+def auto_tune(
+    target_seconds_per_minute: float,
+    settings: RenderSettings = FULL_RENDER,
+    sample_seconds: float = 5
+) -> Dict[str, float]:
+    timings = {}
+
+    # The best quality goes first, so the first profile within the budget wins and the rest are not measured
+    for profile in reversed(list(ENCODING_PROFILES.values())):
+        timings[profile.name] = benchmark_profile(profile, settings, sample_seconds)
+        logger.info(f'Encoding profile {profile.name}: {timings[profile.name]:.1f} s per output minute')
+
+        if timings[profile.name] <= target_seconds_per_minute:
+            break
+
+    return timings
+
+
+def pick_profile(timings: Dict[str, float], target_seconds_per_minute: float) -> EncodingProfile:
+    within_budget = [name for name in ENCODING_PROFILES if name in timings and timings[name] <= target_seconds_per_minute]
+
+    if within_budget:
+        return ENCODING_PROFILES[within_budget[-1]]
+
+    # Nothing meets the budget on this machine, so the fastest profile is the closest
+    return ENCODING_PROFILES[min(timings, key=timings.get)]
+
+
+def tuned_profile(
+    cache: ArtifactCache,
+    target_seconds_per_minute: Optional[float] = None,
+    settings: RenderSettings = FULL_RENDER
+) -> EncodingProfile:
+    target_seconds_per_minute = target_seconds_per_minute or float(os.getenv('ENCODING_TARGET_SECONDS_PER_MINUTE', 60))
+    sample_seconds = float(os.getenv('ENCODING_TUNE_SAMPLE_SECONDS', 5))
+
+    # Measurements are kept per machine type, so a node only benchmarks itself once
+    inputs = {
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'profiles': [dataclasses.asdict(profile) for profile in ENCODING_PROFILES.values()],
+        'frame_size': list(settings.frame_size),
+        'fps': settings.fps,
+        'target': target_seconds_per_minute,
+    }
+    timings_path = cache.get('encoding', inputs, 'json')
+
+    if timings_path is None:
+        timings = auto_tune(target_seconds_per_minute, settings, sample_seconds)
+        cache.put_bytes('encoding', inputs, 'json', json.dumps(timings).encode('utf-8'))
+    else:
+        with open(timings_path, 'r') as f:
+            timings = json.load(f)
+
+    profile = pick_profile(timings, target_seconds_per_minute)
+    logger.info(f'Using the {profile.name} encoding profile for a budget of {target_seconds_per_minute} s per minute')
+
+    return profile
+
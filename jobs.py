@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import time
+import uuid
+from typing import Optional, List
+
+STAGES = ['scenario', 'narration', 'subtitles', 'stock', 'render']
+
+
+class JobStore:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('JOBS_DB', 'jobs.sqlite3')
+        self.connection = sqlite3.connect(self.path)
+        self.connection.row_factory = sqlite3.Row
+
+        with self.connection:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    theme TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    output_path TEXT,
+                    updated_at REAL NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS stages (
+                    job_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    artifact TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, stage)
+                );
+            ''')
+
+    @staticmethod
+    def job_id(theme: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_DNS, theme))
+
+    def job(self, job_id: str) -> Optional[sqlite3.Row]:
+        return self.connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+    def jobs(self, status: Optional[str] = None) -> List[sqlite3.Row]:
+        if status is None:
+            return self.connection.execute('SELECT * FROM jobs ORDER BY updated_at').fetchall()
+
+        return self.connection.execute(
+            'SELECT * FROM jobs WHERE status = ? ORDER BY updated_at',
+            (status,)
+        ).fetchall()
+
+    def stages(self, job_id: str) -> List[sqlite3.Row]:
+        return self.connection.execute(
+            'SELECT job_id, stage, status, attempts, error, updated_at FROM stages WHERE job_id = ?',
+            (job_id,)
+        ).fetchall()
+
+    def add(self, theme: str) -> str:
+        job_id = self.job_id(theme)
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO jobs (id, theme, status, updated_at) VALUES (?, ?, ?, ?)',
+                (job_id, theme, 'pending', time.time())
+            )
+
+        return job_id
+
+    def start(self, job_id: str):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, error = NULL, updated_at = ? WHERE id = ?',
+                ('running', time.time(), job_id)
+            )
+
+    def finish(self, job_id: str, output_path: str):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, output_path = ?, updated_at = ? WHERE id = ?',
+                ('done', output_path, time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: Exception):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?',
+                ('failed', repr(error), time.time(), job_id)
+            )
+
+    def stage_artifact(self, job_id: str, stage: str) -> Optional[str]:
+        row = self.connection.execute(
+            'SELECT artifact FROM stages WHERE job_id = ? AND stage = ? AND status = ?',
+            (job_id, stage, 'done')
+        ).fetchone()
+
+        return row['artifact'] if row is not None else None
+
+    def start_stage(self, job_id: str, stage: str):
+        with self.connection:
+            self.connection.execute(
+                '''
+                INSERT INTO stages (job_id, stage, status, attempts, updated_at) VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT (job_id, stage) DO UPDATE SET
+                    status = excluded.status,
+                    attempts = attempts + 1,
+                    error = NULL,
+                    updated_at = excluded.updated_at
+                ''',
+                (job_id, stage, 'running', time.time())
+            )
+
+    def complete_stage(self, job_id: str, stage: str, artifact: str):
+        later_stages = STAGES[STAGES.index(stage) + 1:]
+
+        with self.connection:
+            self.connection.execute(
+                'UPDATE stages SET status = ?, artifact = ?, updated_at = ? WHERE job_id = ? AND stage = ?',
+                ('done', artifact, time.time(), job_id, stage)
+            )
+
+            # A stage that had to run again invalidates everything that was built on top of it
+            if later_stages:
+                self.connection.execute(
+                    f'DELETE FROM stages WHERE job_id = ? AND stage IN ({", ".join("?" * len(later_stages))})',
+                    (job_id, *later_stages)
+                )
+
+    def fail_stage(self, job_id: str, stage: str, error: Exception):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE stages SET status = ?, error = ?, updated_at = ? WHERE job_id = ? AND stage = ?',
+                ('failed', repr(error), time.time(), job_id, stage)
+            )
+
+    def close(self):
+        self.connection.close()
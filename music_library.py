@@ -0,0 +1,153 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, List
+
+import numpy as np
+
+from cache import file_hash
+from transcode import decode_audio
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SONG_EXTENSIONS = ('.m4a', '.mp3')
+
+
+class MusicLibrary:
+    def __init__(self, folder: str, path: Optional[str] = None, target_dbfs: Optional[float] = None):
+        self.folder = folder
+        self.path = path or f'{folder}/index.sqlite3'
+        self.pcm_folder = f'{folder}/pcm'
+        self.target_dbfs = target_dbfs if target_dbfs is not None else float(os.getenv('MUSIC_TARGET_DBFS', -20))
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        with self.lock, self.connection:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS songs (
+                    path TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    pcm_path TEXT NOT NULL,
+                    duration REAL NOT NULL,
+                    rms_dbfs REAL NOT NULL,
+                    gain REAL NOT NULL,
+                    target_dbfs REAL NOT NULL,
+                    indexed_at REAL NOT NULL
+                );
+            ''')
+
+    def add(self, path: str) -> sqlite3.Row:
+        samples = decode_audio(path, SAMPLE_RATE, CHANNELS)
+        rms = float(np.sqrt(np.mean(np.square(samples)))) if len(samples) else 0.0
+        peak = float(np.max(np.abs(samples))) if len(samples) else 0.0
+        rms_dbfs = 20 * np.log10(rms) if rms > 0 else -120.0
+
+        # Every song is brought to the same loudness, without pushing its peaks into clipping
+        gain = 10 ** ((self.target_dbfs - rms_dbfs) / 20)
+        if peak > 0:
+            gain = min(gain, 1.0 / peak)
+
+        Path(self.pcm_folder).mkdir(parents=True, exist_ok=True)
+        song_hash = file_hash(path)
+        pcm_path = f'{self.pcm_folder}/{song_hash}.f32'
+
+        tmp_path = f'{pcm_path}.tmp'
+        (samples * gain).astype(np.float32).tofile(tmp_path)
+        os.replace(tmp_path, pcm_path)
+
+        stat = os.stat(path)
+        with self.lock, self.connection:
+            self.connection.execute(
+                '''
+                INSERT OR REPLACE INTO songs (
+                    path, hash, size, mtime, pcm_path, duration, rms_dbfs, gain, target_dbfs, indexed_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                (
+                    path, song_hash, stat.st_size, stat.st_mtime, pcm_path, len(samples) / SAMPLE_RATE,
+                    rms_dbfs, gain, self.target_dbfs, time.time(),
+                )
+            )
+
+        return self.get(path)
+
+    def get(self, path: str) -> Optional[sqlite3.Row]:
+        with self.lock:
+            return self.connection.execute('SELECT * FROM songs WHERE path = ?', (path,)).fetchone()
+
+    def songs(self) -> List[sqlite3.Row]:
+        with self.lock:
+            return self.connection.execute('SELECT * FROM songs ORDER BY path').fetchall()
+
+    def is_current(self, row: Optional[sqlite3.Row]) -> bool:
+        if row is None or not os.path.exists(row['path']) or not os.path.exists(row['pcm_path']):
+            return False
+
+        stat = os.stat(row['path'])
+
+        return stat.st_size == row['size'] and stat.st_mtime == row['mtime'] and row['target_dbfs'] == self.target_dbfs
+
+    def scan(self):
+        # Songs are decoded and normalized once, and again only when the file or the target loudness changes
+        song_paths = [
+            f'{self.folder}/{filename}' for filename in sorted(os.listdir(self.folder))
+            if filename.endswith(SONG_EXTENSIONS)
+        ]
+
+        for path in song_paths:
+            if self.is_current(self.get(path)):
+                continue
+
+            try:
+                row = self.add(path)
+                logger.info(f'Indexed {path}: {row["duration"]:.1f} s, {row["rms_dbfs"]:.1f} dBFS')
+            except Exception as e:
+                logger.warning(f'Could not index {path}: {e}')
+
+        for row in self.songs():
+            if row['path'] not in song_paths:
+                self.remove(row)
+
+    def remove(self, row: sqlite3.Row):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM songs WHERE path = ?', (row['path'],))
+            shared = self.connection.execute('SELECT 1 FROM songs WHERE pcm_path = ?', (row['pcm_path'],)).fetchone()
+
+        if shared is None and os.path.exists(row['pcm_path']):
+            os.remove(row['pcm_path'])
+
+    def select(self, min_duration: Optional[float] = None) -> sqlite3.Row:
+        songs = self.songs()
+
+        if not songs:
+            raise Exception(f'No songs indexed in {self.folder}')
+
+        # A song that outlasts the narration is preferred, so the music does not stop before the end
+        long_enough = [row for row in songs if min_duration is None or row['duration'] >= min_duration]
+        if long_enough:
+            return random.choice(long_enough)
+
+        return max(songs, key=lambda row: row['duration'])
+
+    def song(self, path: str) -> sqlite3.Row:
+        row = self.get(path)
+
+        if not self.is_current(row):
+            row = self.add(path)
+
+        return row
+
+    @staticmethod
+    def samples(row: sqlite3.Row) -> np.ndarray:
+        # Memory-mapped, so the render reads the normalized song without decoding or copying it
+        return np.memmap(row['pcm_path'], dtype=np.float32, mode='r').reshape(-1, CHANNELS)
@@ -6,6 +6,7 @@ from dataobjects import Scenario, TranscriptionWord
 
 from Openai.speech_to_text import SpeechToText
 from Openai.text_to_speech import TextToSpeech, Voice
+from tracing import traced
 
 
 class Narrator:
@@ -22,16 +23,39 @@ class Narrator:
             response_format='verbose_json',
         )
 
+        self.speed = 1
+        self.language = 'ru'
+
+    def narration_cache_inputs(self, scenario: Scenario) -> dict:
+        return {
+            'text': scenario.full_scenario,
+            'voice': self.text_to_speech.voice.value,
+            'model': self.text_to_speech.model,
+            'speed': self.speed,
+            'response_format': self.text_to_speech.response_format,
+        }
+
+    def subtitles_cache_inputs(self, audio_hash: str) -> dict:
+        return {
+            'audio': audio_hash,
+            'language': self.language,
+            'model': self.speech_to_text.model,
+            'timestamp_granularities': self.speech_to_text.timestamp_granularities,
+            'response_format': self.speech_to_text.response_format,
+        }
+
+    @traced()
     async def narrate(self, scenario: Scenario) -> bytes:
         return await self.text_to_speech.text_to_speech(
             scenario.full_scenario,
-            speed=1
+            speed=self.speed
         )
 
+    @traced()
     async def get_subtitles(self, file_path: str) -> List[Dict]:
         transcription = await self.speech_to_text.speech_to_text(
             file=Path(file_path),
-            language='ru',
+            language=self.language,
             #prompt=scenario.full_scenario,
         )
 
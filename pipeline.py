@@ -0,0 +1,496 @@
+import asyncio
+import copy
+import dataclasses
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Callable, Awaitable, TYPE_CHECKING
+
+import json5
+
+from cache import ArtifactCache, file_hash
+from dataobjects import Scenario, RenderSpec, AudioMixSettings
+from jobs import JobStore
+from tracing import tracer
+
+# moviepy, numpy and the API clients are only imported by the stages that use them,
+# so the CLI starts without loading them
+if TYPE_CHECKING:
+    from editor import Editor, StockFinder
+    from narrator import Narrator
+    from render import RenderFarm
+    from scenario import Writer
+
+logger = logging.getLogger(__name__)
+
+
+API_STAGES = ('scenario', 'narration', 'subtitles')
+
+
+@dataclasses.dataclass
+class StageLimits:
+    scenario: int = 4
+    narration: int = 4
+    transcription: int = 4
+    stock: int = 2
+    prefetch: int = 2
+    prefetch_per_block: int = 2
+
+    @staticmethod
+    def from_env():
+        defaults = StageLimits()
+
+        return StageLimits(
+            scenario=int(os.getenv('SCENARIO_CONCURRENCY', defaults.scenario)),
+            narration=int(os.getenv('NARRATION_CONCURRENCY', defaults.narration)),
+            transcription=int(os.getenv('TRANSCRIPTION_CONCURRENCY', defaults.transcription)),
+            stock=int(os.getenv('STOCK_CONCURRENCY', defaults.stock)),
+            prefetch=int(os.getenv('PREFETCH_CONCURRENCY', defaults.prefetch)),
+            prefetch_per_block=int(os.getenv('PREFETCH_PER_BLOCK', defaults.prefetch_per_block)),
+        )
+
+
+class Pipeline:
+    def __init__(
+        self,
+        writer: 'Writer',
+        narrator: 'Narrator',
+        editor: Optional['Editor'],
+        stock: Optional['StockFinder'],
+        render_farm: Optional['RenderFarm'],
+        cache: ArtifactCache,
+        jobs: JobStore,
+        output_directory: str,
+        video_output_directory: str,
+        limits: Optional[StageLimits] = None,
+        draft: bool = False,
+        encoding: Optional[str] = None,
+        audio_mix: Optional[AudioMixSettings] = None,
+        targets: Optional[List[str]] = None,
+    ):
+        self.writer = writer
+        self.narrator = narrator
+        self.editor = editor
+        self.stock = stock
+        self.render_farm = render_farm
+        self.cache = cache
+        self.jobs = jobs
+        self.max_attempts = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+        self.output_directory = output_directory
+        self.video_output_directory = video_output_directory
+        self.limits = limits or StageLimits()
+        self.draft = draft
+        self.encoding = encoding
+        self.targets = targets
+        self.audio_mix = audio_mix or AudioMixSettings()
+
+        # Called with every job and stage event, the daemon streams them to its clients
+        self.progress: Optional[Callable[[dict], None]] = None
+
+        # The daemon runs batches side by side and evicts itself once none of them needs the files
+        self.evict_after_batch = True
+
+        # Each stage gets its own semaphore, so a theme waiting for a render worker
+        # does not hold back the API calls of the themes behind it.
+        # The render stage is limited by the size of the render farm.
+        self.scenario_slots = asyncio.Semaphore(self.limits.scenario)
+        self.narration_slots = asyncio.Semaphore(self.limits.narration)
+        self.transcription_slots = asyncio.Semaphore(self.limits.transcription)
+        self.stock_slots = asyncio.Semaphore(self.limits.stock)
+        self.prefetch_slots = asyncio.Semaphore(self.limits.prefetch)
+
+    def with_output_directory(self, output_directory: str) -> 'Pipeline':
+        # Shares the stage slots, the job store, the cache and the clients, only the outputs go elsewhere
+        pipeline = copy.copy(self)
+        pipeline.output_directory = output_directory
+        pipeline.video_output_directory = f'{output_directory}/videos'
+
+        return pipeline
+
+    async def run(self, themes: List[str]) -> List[Optional[str]]:
+        Path(self.output_directory).mkdir(parents=True, exist_ok=True)
+        Path(self.video_output_directory).mkdir(parents=True, exist_ok=True)
+
+        job_ids = [self.jobs.add(theme) for theme in themes]
+
+        try:
+            return await asyncio.gather(*(
+                self.process_job(job_id, theme) for job_id, theme in zip(job_ids, themes)
+            ))
+        finally:
+            if self.evict_after_batch:
+                self.evict()
+
+    async def run_until(self, theme: str, stage: str) -> str:
+        # Runs the API stages of one theme up to the given one, so each can be produced and inspected on its own
+        if stage not in API_STAGES:
+            raise Exception(f'Unknown stage {stage}, expected one of {", ".join(API_STAGES)}')
+
+        Path(self.output_directory).mkdir(parents=True, exist_ok=True)
+        job_id = self.jobs.add(theme)
+
+        with tracer.track(theme), tracer.span('theme', theme=theme):
+            artifact = await self.run_stage(job_id, 'scenario', lambda: self.get_scenario(theme))
+            if stage == 'scenario':
+                return artifact
+
+            scenario = self.load_scenario(artifact)
+            artifact = await self.run_stage(job_id, 'narration', lambda: self.get_narration(scenario))
+            if stage == 'narration':
+                return artifact
+
+            return await self.run_stage(job_id, 'subtitles', lambda: self.get_subtitles(artifact))
+
+    def report(self, job_id: str, event: str, **fields):
+        if self.progress is not None:
+            self.progress({'job_id': job_id, 'event': event, **fields})
+
+    async def process_job(self, job_id: str, theme: str) -> Optional[str]:
+        job = self.jobs.job(job_id)
+
+        # A finished job is only reused when it was rendered with the settings of this run
+        if (
+            job['status'] == 'done' and job['output_path'] and os.path.exists(job['output_path'])
+            and self.render_spec_matches(theme, self.jobs.stage_artifact(job_id, 'stock'))
+        ):
+            self.report(job_id, 'done', theme=theme, output_path=job['output_path'])
+
+            return job['output_path']
+
+        if job['status'] == 'failed' and job['attempts'] >= self.max_attempts:
+            logger.warning(f'Skipping "{theme}" after {job["attempts"]} failed attempts: {job["error"]}')
+            self.report(job_id, 'failed', theme=theme, error=job['error'])
+
+            return None
+
+        self.jobs.start(job_id)
+        self.report(job_id, 'started', theme=theme)
+
+        try:
+            with tracer.track(theme), tracer.span('theme', theme=theme):
+                output_path = await self.process_theme(job_id, theme)
+        except Exception as e:
+            logger.error(f'Failed "{theme}": {e!r}')
+            self.jobs.fail(job_id, e)
+            self.report(job_id, 'failed', theme=theme, error=repr(e))
+
+            return None
+
+        self.jobs.finish(job_id, output_path)
+        self.report(job_id, 'done', theme=theme, output_path=output_path)
+
+        print('Done ' + theme)
+
+        return output_path
+
+    async def process_theme(self, job_id: str, theme: str) -> str:
+        scenario_path = await self.run_stage(job_id, 'scenario', lambda: self.get_scenario(theme))
+        scenario = self.load_scenario(scenario_path)
+
+        # The keywords are known now, so footage is fetched while narration and transcription run
+        prefetch = None
+        if self.jobs.stage_artifact(job_id, 'stock') is None:
+            prefetch = asyncio.create_task(self.prefetch_stock(self.load_scenario(scenario_path)))
+
+        try:
+            scenario.narration_path = await self.run_stage(job_id, 'narration', lambda: self.get_narration(scenario))
+            subtitles_path = await self.run_stage(
+                job_id,
+                'subtitles',
+                lambda: self.get_subtitles(scenario.narration_path)
+            )
+        except BaseException:
+            if prefetch is not None:
+                prefetch.cancel()
+
+            raise
+
+        with open(subtitles_path, 'r') as f:
+            subtitles_json = json5.load(f)
+
+        self.narrator.add_transcription_words_and_subtitles(scenario, subtitles_json)
+        self.editor.split_words_into_lines(scenario)
+
+        if prefetch is not None:
+            await prefetch
+
+        spec_json = await self.run_stage(
+            job_id,
+            'stock',
+            lambda: self.get_render_spec(scenario, self.output_path(theme, self.draft)),
+            valid=lambda spec_json: self.render_spec_matches(theme, spec_json) and self.render_spec_is_valid(spec_json),
+        )
+        spec = RenderSpec.from_dict(json.loads(spec_json))
+
+        return await self.run_stage(job_id, 'render', lambda: self.get_render(spec))
+
+    def output_path(self, theme: str, draft: bool = False) -> str:
+        return f'{self.video_output_directory}/{theme}.draft.mp4' if draft else f'{self.video_output_directory}/{theme}.mp4'
+
+    async def finalize(self, themes: List[str]) -> List[Optional[str]]:
+        Path(self.video_output_directory).mkdir(parents=True, exist_ok=True)
+
+        try:
+            return await asyncio.gather(*(self.finalize_job(self.jobs.job_id(theme), theme) for theme in themes))
+        finally:
+            if self.evict_after_batch:
+                self.evict()
+
+    def evict(self):
+        self.cache.evict()
+        self.editor.library.evict()
+        logger.info(self.editor.library.report())
+
+    async def finalize_job(self, job_id: str, theme: str) -> Optional[str]:
+        # Re-renders an approved draft at full quality from its stored spec, without calling any API
+        spec_json = self.jobs.stage_artifact(job_id, 'stock')
+
+        if spec_json is None:
+            logger.warning(f'No draft to finalize for "{theme}"')
+            self.report(job_id, 'failed', theme=theme, error='No draft to finalize')
+
+            return None
+
+        spec = RenderSpec.from_dict(json.loads(spec_json))
+        self.report(job_id, 'started', theme=theme)
+
+        try:
+            with tracer.track(theme), tracer.span('finalize', theme=theme):
+                async with self.stock_slots:
+                    spec = await asyncio.to_thread(self.editor.full_quality_spec, spec, self.output_path(theme))
+
+                spec = dataclasses.replace(spec, encoding=self.encoding, targets=self.targets)
+
+                output_path = await self.get_render(spec)
+        except Exception as e:
+            logger.error(f'Failed to finalize "{theme}": {e!r}')
+            self.report(job_id, 'failed', theme=theme, error=repr(e))
+
+            return None
+
+        self.jobs.finish(job_id, output_path)
+        self.report(job_id, 'done', theme=theme, output_path=output_path)
+
+        print('Finalized ' + theme)
+
+        return output_path
+
+    async def run_stage(
+        self,
+        job_id: str,
+        stage: str,
+        produce: Callable[[], Awaitable[str]],
+        valid: Callable[[str], bool] = os.path.exists,
+    ) -> str:
+        artifact = self.jobs.stage_artifact(job_id, stage)
+
+        if artifact is not None and valid(artifact):
+            self.report(job_id, 'stage', stage=stage, status='reused')
+
+            return artifact
+
+        self.jobs.start_stage(job_id, stage)
+        self.report(job_id, 'stage', stage=stage, status='running')
+
+        try:
+            with tracer.span(f'stage.{stage}'):
+                artifact = await produce()
+        except Exception as e:
+            self.jobs.fail_stage(job_id, stage, e)
+            self.report(job_id, 'stage', stage=stage, status='failed', error=repr(e))
+
+            raise e
+
+        self.jobs.complete_stage(job_id, stage, artifact)
+        self.report(job_id, 'stage', stage=stage, status='done')
+
+        return artifact
+
+    async def prefetch_stock(self, scenario: Scenario):
+        try:
+            with tracer.span('stage.prefetch'):
+                # Without transcribed words the candidates are searched with the default block duration
+                async with self.prefetch_slots:
+                    await self.stock.add_stock_video_candidates(scenario)
+
+                candidates = self.editor.prefetch_candidates(scenario, self.limits.prefetch_per_block)
+                await asyncio.to_thread(self.editor.download_videos, candidates)
+        except Exception as e:
+            logger.warning(f'Prefetching stock footage failed: {e!r}')
+
+    def render_settings(self, theme: str) -> dict:
+        # The fields of a render spec that come from the settings of the run rather than from the theme
+        return {
+            'output_path': self.output_path(theme, self.draft),
+            'draft': self.draft,
+            'encoding': None if self.draft else self.encoding,
+            'targets': None if self.draft else self.targets,
+        }
+
+    def render_spec_matches(self, theme: str, spec_json: Optional[str]) -> bool:
+        if spec_json is None:
+            return False
+
+        spec = RenderSpec.from_dict(json.loads(spec_json))
+
+        return all(getattr(spec, name) == value for name, value in self.render_settings(theme).items())
+
+    @staticmethod
+    def render_spec_is_valid(spec_json: str) -> bool:
+        spec = json.loads(spec_json)
+        paths = [clip['path'] for clip in spec['stock_clips']] + [spec['narration_path'], spec['music_path']]
+
+        return all(os.path.exists(path) for path in paths)
+
+    @staticmethod
+    def load_scenario(scenario_path: str) -> Scenario:
+        with open(scenario_path, 'r') as f:
+            return Scenario.from_dict(json5.load(f))
+
+    async def get_scenario(self, theme: str) -> str:
+        inputs = self.writer.scenario_cache_inputs(theme)
+        scenario_path = self.cache.get('scenario', inputs, 'json')
+
+        if scenario_path is None:
+            async with self.scenario_slots:
+                scenario_result = await self.writer.write_scenario(
+                    subject=theme,
+                )
+
+            if scenario_result.is_err():
+                logger.error(scenario_result)
+
+                raise Exception(scenario_result.err())
+
+            scenario: Scenario = scenario_result.ok()
+
+            scenario_path = self.cache.put_bytes(
+                'scenario',
+                inputs,
+                'json',
+                json5.dumps(scenario.to_json(), ensure_ascii=False, indent=4).encode('utf-8'),
+            )
+
+        return scenario_path
+
+    async def get_narration(self, scenario: Scenario) -> str:
+        inputs = self.narrator.narration_cache_inputs(scenario)
+        narration_path = self.cache.get('narration', inputs, 'mp3')
+
+        if narration_path is None:
+            async with self.narration_slots:
+                mp3_bytes = await self.narrator.narrate(scenario)
+
+            narration_path = self.cache.put_bytes('narration', inputs, 'mp3', mp3_bytes)
+
+        return narration_path
+
+    async def get_subtitles(self, narration_path: str) -> str:
+        inputs = self.narrator.subtitles_cache_inputs(await asyncio.to_thread(file_hash, narration_path))
+        subtitles_path = self.cache.get('subtitles', inputs, 'json')
+
+        if subtitles_path is None:
+            async with self.transcription_slots:
+                subtitles = await self.narrator.get_subtitles(narration_path)
+
+            subtitles_path = self.cache.put_bytes(
+                'subtitles',
+                inputs,
+                'json',
+                json5.dumps(subtitles, ensure_ascii=False, indent=4).encode('utf-8'),
+            )
+
+        return subtitles_path
+
+    async def get_render_spec(self, scenario: Scenario, output_path: str) -> str:
+        from transcode import media_duration
+
+        async with self.stock_slots:
+            await self.stock.add_stock_video_candidates(scenario)
+            stock_clips = await asyncio.to_thread(self.editor.prepare_stock_video_clips, scenario, self.draft)
+
+        # Probing the narration and picking a song run ffmpeg and may scan the music folder
+        narration_duration = await asyncio.to_thread(media_duration, scenario.narration_path)
+        music_path = await asyncio.to_thread(self.editor.select_background_music, narration_duration)
+
+        spec = RenderSpec(
+            scenario=scenario,
+            stock_clips=stock_clips,
+            narration_path=scenario.narration_path,
+            music_path=music_path,
+            output_path=output_path,
+            draft=self.draft,
+            encoding=None if self.draft else self.encoding,
+            targets=None if self.draft else self.targets,
+        )
+
+        return json.dumps(spec.to_json(), ensure_ascii=False)
+
+    async def get_audio_mix(self, spec: RenderSpec) -> str:
+        from audio_mix import render_audio_mix
+
+        song = await asyncio.to_thread(self.editor.music.song, spec.music_path)
+        inputs = {
+            'narration': await asyncio.to_thread(file_hash, spec.narration_path),
+            'music': song['hash'],
+            'music_gain': song['gain'],
+            'mix': dataclasses.asdict(self.audio_mix),
+        }
+        audio_path = self.cache.get('audio', inputs, 'm4a')
+
+        if audio_path is None:
+            with tracer.span('stage.audio'), tempfile.TemporaryDirectory() as directory:
+                mix_path = await asyncio.to_thread(
+                    render_audio_mix,
+                    spec.narration_path,
+                    self.editor.music.samples(song),
+                    f'{directory}/mix.m4a',
+                    self.audio_mix
+                )
+                audio_path = self.cache.put_file('audio', inputs, 'm4a', mix_path)
+
+        return audio_path
+
+    async def get_render(self, spec: RenderSpec) -> str:
+        # The audio is mixed once up front, so the render only muxes the finished track
+        spec = dataclasses.replace(spec, audio_path=await self.get_audio_mix(spec))
+        spec_json = spec.to_json()
+        inputs = {
+            'lines': spec_json['lines'],
+            'stock_clips': spec_json['stock_clips'],
+            # A stock file prepared again under the same path is told apart by its content
+            'stock_hashes': list(await asyncio.gather(*(
+                asyncio.to_thread(file_hash, clip.path) for clip in spec.stock_clips
+            ))),
+            'narration': await asyncio.to_thread(file_hash, spec.narration_path),
+            'music': await asyncio.to_thread(file_hash, spec.music_path),
+            'renderer': self.editor.render_cache_inputs(spec),
+            'draft': spec.draft,
+            'encoding': dataclasses.asdict(spec.profile()),
+            'audio_mix': dataclasses.asdict(self.audio_mix),
+        }
+        if spec.targets:
+            inputs['targets'] = [dataclasses.asdict(target) for target in spec.output_targets()]
+
+        # Every format of the render is cached on its own, the first one under the inputs of the render
+        paths = spec.target_paths()
+        target_inputs = {name: {**inputs, 'target': name} for name in list(paths)[1:]}
+        cached_paths = {spec.output_path: self.cache.get('render', inputs, 'mp4')}
+        for name, target_input in target_inputs.items():
+            cached_paths[paths[name]] = self.cache.get('render', target_input, 'mp4')
+
+        if None in cached_paths.values():
+            output_path = await self.render_farm.submit(spec)
+            self.cache.put_file('render', inputs, 'mp4', output_path)
+
+            for name, target_input in target_inputs.items():
+                self.cache.put_file('render', target_input, 'mp4', paths[name])
+
+            return output_path
+
+        for path, cached_path in cached_paths.items():
+            self.cache.restore(cached_path, path)
+
+        return spec.output_path
@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import resource
+import time
+from typing import Dict, List, Optional
+
+from moviepy.Clip import Clip
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss_kb() -> Optional[int]:
+    # Resident set size right now, from /proc on Linux
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return None
+
+
+class LayerStats:
+    def __init__(self, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+        self.calls = 0
+        self.seconds = 0.0
+
+    def to_json(self) -> dict:
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'ms_per_call': self.seconds / self.calls * 1000 if self.calls else 0.0,
+        }
+
+
+class RenderProfiler:
+    # Wraps get_frame of every layer and of the composited frame. Each call costs two perf_counter reads,
+    # so it can stay on for a share of production renders
+    def __init__(self):
+        self.layers: List[LayerStats] = []
+        self.frame = LayerStats('composited frame', 'frame')
+        self.audio = LayerStats('audio', 'audio')
+        self.write_seconds = 0.0
+        self.started = None
+        self.peak_rss_kb: Optional[int] = None
+
+    @staticmethod
+    def timed(clip: Clip, stats: LayerStats):
+        get_frame = clip.get_frame
+
+        def timed_get_frame(t):
+            started = time.perf_counter()
+
+            try:
+                return get_frame(t)
+            finally:
+                stats.seconds += time.perf_counter() - started
+                stats.calls += 1
+
+        # An instance attribute shadows the method, blit_on and the compositor both go through it
+        clip.get_frame = timed_get_frame
+
+    def layer(self, clip: Clip, name: str, kind: str) -> Clip:
+        stats = LayerStats(name, kind)
+        self.layers.append(stats)
+        self.timed(clip, stats)
+
+        # The mask of a caption is evaluated with it for every frame, so it counts towards the same layer
+        if getattr(clip, 'mask', None) is not None:
+            self.timed(clip.mask, stats)
+
+        return clip
+
+    def sample_rss(self):
+        rss = current_rss_kb()
+
+        if rss is not None:
+            self.peak_rss_kb = max(self.peak_rss_kb or 0, rss)
+
+    def output(self, video: Clip) -> Clip:
+        self.timed(video, self.frame)
+        get_frame = video.get_frame
+
+        # The peak of the process covers every render a worker ran, so memory is sampled with each frame of this one
+        def sampled_get_frame(t):
+            frame = get_frame(t)
+            self.sample_rss()
+
+            return frame
+
+        video.get_frame = sampled_get_frame
+
+        if video.audio is not None:
+            self.timed(video.audio, self.audio)
+
+        return video
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.sample_rss()
+
+    def stop(self):
+        self.write_seconds = time.perf_counter() - self.started
+        self.sample_rss()
+
+    def report(self, output_path: str) -> dict:
+        layer_seconds = sum(stats.seconds for stats in self.layers)
+        kinds: Dict[str, LayerStats] = {}
+
+        for stats in self.layers:
+            total = kinds.setdefault(stats.kind, LayerStats(stats.kind, stats.kind))
+            total.calls += stats.calls
+            total.seconds += stats.seconds
+
+        # What the write took besides producing frames and audio went to piping frames into x264
+        encoder_seconds = max(0.0, self.write_seconds - self.frame.seconds - self.audio.seconds)
+
+        return {
+            'output_path': output_path,
+            'frames': self.frame.calls,
+            'seconds': self.write_seconds,
+            'fps': self.frame.calls / self.write_seconds if self.write_seconds else 0.0,
+            'frame_seconds': self.frame.seconds,
+            'compositing_seconds': max(0.0, self.frame.seconds - layer_seconds),
+            'audio_seconds': self.audio.seconds,
+            'encoder_seconds': encoder_seconds,
+            # Kilobytes; ffmpeg runs in its own process and is not included
+            'peak_rss_kb': self.peak_rss_kb,
+            'worker_lifetime_peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'kinds': [stats.to_json() for stats in sorted(kinds.values(), key=lambda stats: -stats.seconds)],
+            'layers': [stats.to_json() for stats in sorted(self.layers, key=lambda stats: -stats.seconds)],
+        }
+
+    @staticmethod
+    def summary(report: dict) -> str:
+        rows = [
+            f'{report["frames"]} frames in {report["seconds"]:.2f} s, {report["fps"]:.1f} fps, '
+            f'peak RSS {(report["peak_rss_kb"] or 0) / 1024:.0f} MB '
+            f'(worker lifetime {report["worker_lifetime_peak_rss_kb"] / 1024:.0f} MB)',
+            f'{"layer":<50} {"calls":>7} {"total s":>9} {"ms/call":>9}',
+        ]
+
+        for stats in report['layers']:
+            rows.append(f'{stats["name"]:<50} {stats["calls"]:>7} {stats["seconds"]:>9.2f} {stats["ms_per_call"]:>9.2f}')
+
+        for name in ('compositing', 'audio', 'encoder'):
+            rows.append(f'{name:<50} {"":>7} {report[name + "_seconds"]:>9.2f}')
+
+        return '\n'.join(rows)
+
+    def write(self, output_path: str) -> str:
+        report = self.report(output_path)
+        report_path = f'{os.path.splitext(output_path)[0]}.profile.json'
+
+        with open(report_path, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+
+        logger.info(f'Render profile written to {report_path}\n{self.summary(report)}')
+
+        return report_path
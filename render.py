@@ -0,0 +1,133 @@
+import asyncio
+import functools
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple, List, TYPE_CHECKING
+
+from dataobjects import RenderSpec, StockClipSpec, RenderSettings
+from tracing import tracer
+from transcode import run_ffmpeg, concat_args, write_concat_list, media_duration
+
+if TYPE_CHECKING:
+    from editor import Editor
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache
+def worker_editor() -> 'Editor':
+    # Runs inside a worker process, so the editor is imported and built here, once per worker.
+    # Its library connections, downloader and caches then stay warm from one job to the next
+    from editor import Editor
+
+    return Editor()
+
+
+def render_job(spec_json: dict) -> Tuple[str, List[dict]]:
+    spec = RenderSpec.from_dict(spec_json)
+    tracer.drain()
+
+    with tracer.track(Path(spec.output_path).stem):
+        output_path = worker_editor().render(spec)
+
+    # Spans recorded in the worker are handed back to the tracer of the main process
+    return output_path, tracer.drain()
+
+
+def render_segment_job(spec_json: dict, start_frame: int, end_frame: int, output_path: str) -> Tuple[str, List[dict]]:
+    spec = RenderSpec.from_dict(spec_json)
+    tracer.drain()
+
+    with tracer.track(Path(output_path).stem):
+        worker_editor().render_segment(spec, start_frame, end_frame, output_path)
+
+    return output_path, tracer.drain()
+
+
+def segment_frames(stock_clips: List[StockClipSpec], duration: float, fps: int) -> List[Tuple[int, int]]:
+    # The timeline is cut where the stock footage changes, snapped to the frame grid
+    total_frames = math.ceil(duration * fps)
+    cuts = sorted({0, total_frames, *(
+        round(clip.start * fps) for clip in stock_clips if 0 < round(clip.start * fps) < total_frames
+    )})
+
+    return list(zip(cuts, cuts[1:]))
+
+
+class RenderFarm:
+    def __init__(self, workers: Optional[int] = None, segmented: Optional[bool] = None):
+        self.workers = workers or int(os.getenv('RENDER_WORKERS', max(1, (os.cpu_count() or 1) // 4)))
+
+        # Segmented renders split one short across all the workers instead of rendering it in one
+        if segmented is None:
+            segmented = os.getenv('RENDER_SEGMENTED', 'false').lower() in ('1', 'true', 'yes')
+
+        self.segmented = segmented
+
+        # Spawned workers do not inherit the event loop and the API client threads of the parent
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+
+    def submit(self, spec: RenderSpec) -> asyncio.Future:
+        logger.info(f'Submitting render of {spec.output_path} ({self.workers} workers)')
+
+        # Segments are joined into a single file, so renders to several targets go to one worker
+        if self.segmented and not spec.targets:
+            return asyncio.ensure_future(self.render_segmented(spec))
+
+        return asyncio.ensure_future(self.render(spec))
+
+    async def render(self, spec: RenderSpec) -> str:
+        output_path, events = await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            render_job,
+            spec.to_json()
+        )
+        tracer.extend(events)
+
+        return output_path
+
+    async def render_segmented(self, spec: RenderSpec) -> str:
+        settings = RenderSettings.for_draft(spec.draft)
+        # Probing the narration runs ffmpeg, so it stays off the event loop
+        duration = await asyncio.to_thread(media_duration, spec.narration_path)
+        segments = segment_frames(spec.stock_clips, duration, settings.fps)
+        spec_json = spec.to_json()
+        loop = asyncio.get_running_loop()
+
+        output_directory = Path(spec.output_path).parent
+        output_directory.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.TemporaryDirectory(dir=output_directory) as segments_directory:
+            segment_paths = [f'{segments_directory}/segment_{i:04d}.mp4' for i in range(len(segments))]
+
+            with tracer.span('RenderFarm.render_segmented', segments=len(segments)):
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(self.executor, render_segment_job, spec_json, start, end, path)
+                    for (start, end), path in zip(segments, segment_paths)
+                ))
+
+                for _, events in results:
+                    tracer.extend(events)
+
+                list_path = write_concat_list(segment_paths, f'{segments_directory}/segments.ffconcat')
+                await asyncio.to_thread(run_ffmpeg, concat_args(
+                    list_path,
+                    spec.narration_path,
+                    spec.music_path,
+                    duration,
+                    spec.output_path,
+                    audio_path=spec.audio_path
+                ))
+
+        return spec.output_path
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
@@ -6,6 +6,7 @@ from result import Err, Ok, Result
 import json5
 
 from dataobjects import Scenario
+from tracing import traced
 
 logging.basicConfig(
     format="(%(asctime)s) %(name)s:%(lineno)d [%(levelname)s] | %(message)s", level=logging.INFO
@@ -75,6 +76,15 @@ the given subject.
             config=ModelConfig(temperature=0.1),
         )
 
+    def scenario_cache_inputs(self, subject: str) -> dict:
+        return {
+            'subject': subject,
+            'prompt': self.scenario_system_message,
+            'model': self.gpt4_chat.model,
+            'temperature': self.gpt4_chat.config.temperature,
+        }
+
+    @traced()
     async def write_scenario(
         self,
         subject: str,
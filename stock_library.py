@@ -0,0 +1,260 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional, List
+
+from transcode import probe
+
+logger = logging.getLogger(__name__)
+
+ORIGINAL = 'original'
+TRIMMED = 'trimmed'
+NORMALIZED = 'normalized'
+
+
+class StockLibrary:
+    def __init__(self, folder: str, path: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.folder = folder
+        self.path = path or f'{folder}/index.sqlite3'
+        self.max_bytes = max_bytes or int(os.getenv('STOCK_CACHE_MAX_BYTES', 50 * 1024 ** 3))
+
+        # Clip preparation and downloads use the index from worker threads
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        with self.lock, self.connection:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    pexels_id TEXT NOT NULL,
+                    source_url TEXT,
+                    source_path TEXT,
+                    requested_duration REAL,
+                    duration REAL,
+                    width INTEGER,
+                    height INTEGER,
+                    fps REAL,
+                    codec TEXT,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+
+                CREATE INDEX IF NOT EXISTS files_pexels_id ON files (pexels_id, kind);
+
+                CREATE TABLE IF NOT EXISTS stats (
+                    kind TEXT PRIMARY KEY,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    misses INTEGER NOT NULL DEFAULT 0
+                );
+            ''')
+
+    def add(
+        self,
+        path: str,
+        kind: str,
+        pexels_id,
+        source_url: Optional[str] = None,
+        source_path: Optional[str] = None,
+        requested_duration: Optional[float] = None,
+    ) -> sqlite3.Row:
+        metadata = probe(path)
+        now = time.time()
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                '''
+                INSERT OR REPLACE INTO files (
+                    path, kind, pexels_id, source_url, source_path, requested_duration,
+                    duration, width, height, fps, codec, size, created_at, last_access
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                (
+                    path, kind, str(pexels_id), source_url, source_path, requested_duration,
+                    metadata['duration'], metadata['width'], metadata['height'], metadata['fps'], metadata['codec'],
+                    os.path.getsize(path), now, now,
+                )
+            )
+
+        return self.get(path)
+
+    def get(self, path: str) -> Optional[sqlite3.Row]:
+        with self.lock:
+            return self.connection.execute('SELECT * FROM files WHERE path = ?', (path,)).fetchone()
+
+    def find(
+        self,
+        pexels_id,
+        kind: str,
+        requested_duration: Optional[float] = None,
+        min_duration: Optional[float] = None,
+        height: Optional[int] = None,
+    ) -> Optional[sqlite3.Row]:
+        query = 'SELECT * FROM files WHERE pexels_id = ? AND kind = ?'
+        params = [str(pexels_id), kind]
+
+        if requested_duration is not None:
+            query += ' AND requested_duration = ?'
+            params.append(requested_duration)
+
+        if min_duration is not None:
+            query += ' AND requested_duration >= ?'
+            params.append(min_duration)
+
+        if height is not None:
+            query += ' AND height = ?'
+            params.append(height)
+
+        with self.lock:
+            row = self.connection.execute(query, params).fetchone()
+
+        # Files removed behind the index's back are forgotten instead of being handed out
+        if row is not None and not os.path.exists(row['path']):
+            self.remove(row['path'])
+            row = None
+
+        if row is not None:
+            self.touch(row['path'])
+
+        self.record_lookup(kind, row is not None)
+
+        return row
+
+    def original(self, pexels_id) -> Optional[sqlite3.Row]:
+        return self.find(pexels_id, ORIGINAL)
+
+    def trimmed(self, pexels_id, requested_duration: float, height: Optional[int] = None) -> Optional[sqlite3.Row]:
+        return self.find(pexels_id, TRIMMED, requested_duration, height=height)
+
+    def normalized(self, pexels_id, min_duration: float, height: Optional[int] = None) -> Optional[sqlite3.Row]:
+        return self.find(pexels_id, NORMALIZED, min_duration=min_duration, height=height)
+
+    def has_original(self, pexels_id) -> bool:
+        with self.lock:
+            return self.connection.execute(
+                'SELECT 1 FROM files WHERE pexels_id = ? AND kind = ?',
+                (str(pexels_id), ORIGINAL)
+            ).fetchone() is not None
+
+    def record_lookup(self, kind: str, hit: bool):
+        with self.lock, self.connection:
+            self.connection.execute(
+                f'''
+                INSERT INTO stats (kind, hits, misses) VALUES (?, ?, ?)
+                ON CONFLICT (kind) DO UPDATE SET {'hits = hits + 1' if hit else 'misses = misses + 1'}
+                ''',
+                (kind, int(hit), int(not hit))
+            )
+
+    def report(self) -> str:
+        with self.lock:
+            stats = self.connection.execute('SELECT * FROM stats ORDER BY kind').fetchall()
+            size, count = self.connection.execute('SELECT COALESCE(SUM(size), 0), COUNT(*) FROM files').fetchone()
+
+        rows = [f'stock library: {count} files, {size / 1024 ** 3:.2f} of {self.max_bytes / 1024 ** 3:.2f} GiB']
+        for row in stats:
+            lookups = row['hits'] + row['misses']
+            rows.append(
+                f'{row["kind"]}: {row["hits"]} hits, {row["misses"]} misses '
+                f'({row["hits"] / lookups if lookups else 0:.0%} hit rate)'
+            )
+
+        return '\n'.join(rows)
+
+    def evict(self) -> int:
+        files = self.files()
+        total = sum(row['size'] for row in files)
+
+        if total <= self.max_bytes:
+            return 0
+
+        original_paths = {row['path'] for row in files if row['kind'] == ORIGINAL}
+
+        def priority(row):
+            # Derived variants whose source is still here are rebuilt without a download, so they go first.
+            # Originals go last, since dropping one also costs a download
+            if row['kind'] != ORIGINAL:
+                return 0 if row['source_path'] in original_paths else 1, row['last_access']
+
+            return 2, row['last_access']
+
+        freed = 0
+        for row in sorted(files, key=priority):
+            if total - freed <= self.max_bytes:
+                break
+
+            if os.path.exists(row['path']):
+                os.remove(row['path'])
+
+            self.remove(row['path'])
+            freed += row['size']
+
+        logger.info(f'Evicted {freed} bytes from {self.folder} ({total - freed} bytes left)')
+
+        return freed
+
+    def touch(self, path: str):
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE files SET last_access = ? WHERE path = ?', (time.time(), path))
+
+    def remove(self, path: str):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def files(self) -> List[sqlite3.Row]:
+        with self.lock:
+            return self.connection.execute('SELECT * FROM files').fetchall()
+
+    def scan(self):
+        # Index the files made before the index existed: {id}.{ext}, trimmed_{duration}_{W}x{H}_{id}.{ext}
+        # (without the size when written by older versions) and normalized_{id}[_{W}x{H}].mp4
+        known = {row['path'] for row in self.files()}
+        filenames = [
+            filename for filename in sorted(os.listdir(self.folder))
+            if not filename.startswith('.') and '.' in filename and f'{self.folder}/{filename}' != self.path
+        ]
+
+        # A normalized file does not keep the extension of its source, so it is looked up by id
+        originals = {}
+        for filename in filenames:
+            original = re.fullmatch(r'(\w+)\.(mp4|mov|webm|mkv)', filename)
+
+            if original is not None and not filename.startswith(('trimmed_', 'normalized_')):
+                originals[original.group(1)] = f'{self.folder}/{filename}'
+
+        for filename in filenames:
+            path = f'{self.folder}/{filename}'
+
+            if path in known:
+                continue
+
+            trimmed = re.fullmatch(r'trimmed_([\d.]+)_(?:\d+x\d+_)?(\w+)\.(\w+)', filename)
+            normalized = re.fullmatch(r'normalized_(\w+?)(?:_\d+x\d+)?\.mp4', filename)
+
+            try:
+                if trimmed is not None:
+                    self.add(
+                        path,
+                        TRIMMED,
+                        trimmed.group(2),
+                        source_path=f'{self.folder}/{trimmed.group(2)}.{trimmed.group(3)}',
+                        requested_duration=float(trimmed.group(1)),
+                    )
+                elif normalized is not None:
+                    # A short source is normalized to its own length, so what the file covers is what it lasts
+                    self.add(
+                        path,
+                        NORMALIZED,
+                        normalized.group(1),
+                        source_path=originals.get(normalized.group(1)),
+                        requested_duration=probe(path)['duration'],
+                    )
+                elif path in originals.values():
+                    self.add(path, ORIGINAL, os.path.splitext(filename)[0])
+            except Exception as e:
+                logger.warning(f'Could not index {path}: {e}')
@@ -0,0 +1,43 @@
+import numpy as np
+
+from audio_mix import ducking_gain, mix_audio
+from dataobjects import AudioMixSettings
+
+SAMPLE_RATE = 1000
+
+
+def narration(*levels):
+    # One second per level, the same on both channels
+    return np.repeat(np.array(levels, dtype=np.float32), SAMPLE_RATE)[:, np.newaxis].repeat(2, axis=1)
+
+
+def test_music_is_ducked_under_speech_only():
+    gain = ducking_gain(narration(0.0, 0.5, 0.0), AudioMixSettings(duck_db=20.0), SAMPLE_RATE)
+
+    assert len(gain) == 3 * SAMPLE_RATE
+    assert np.allclose(gain[:500], 1.0)
+    assert np.allclose(gain[1500], 0.1)
+    assert np.allclose(gain[-500:], 1.0)
+
+
+def test_ducking_ramps_instead_of_jumping():
+    gain = ducking_gain(narration(0.0, 0.5), AudioMixSettings(duck_db=20.0), SAMPLE_RATE)
+
+    assert np.all(np.diff(gain) <= 0)
+    assert 0.1 < gain[SAMPLE_RATE] < 1.0
+
+
+def test_mix_without_ducking_keeps_the_music_level():
+    music = np.full((3 * SAMPLE_RATE, 2), 0.5, dtype=np.float32)
+    mixed = mix_audio(narration(0.0, 0.5), music, AudioMixSettings(music_volume=0.1))
+
+    assert mixed.shape == (2 * SAMPLE_RATE, 2)
+    assert np.allclose(mixed[:SAMPLE_RATE], 0.05)
+    assert np.allclose(mixed[SAMPLE_RATE:], 0.55)
+
+
+def test_a_short_song_leaves_silence():
+    music = np.full((SAMPLE_RATE, 2), 0.5, dtype=np.float32)
+    mixed = mix_audio(narration(0.0, 0.0), music, AudioMixSettings(music_volume=0.1))
+
+    assert np.allclose(mixed[SAMPLE_RATE:], 0.0)
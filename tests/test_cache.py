@@ -0,0 +1,64 @@
+import os
+
+from cache import ArtifactCache
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_put_and_get(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+
+    assert cache.get('render', {'a': 1}, 'mp4') is None
+
+    path = cache.put_bytes('render', {'a': 1}, 'mp4', b'video')
+
+    assert cache.get('render', {'a': 1}, 'mp4') == path
+    assert read(path) == b'video'
+    assert cache.get('render', {'a': 2}, 'mp4') is None
+
+
+def test_rewriting_the_output_leaves_the_cache_entry(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    output_path = str(tmp_path / 'video.mp4')
+
+    write(output_path, b'first')
+    cached_path = cache.put_file('render', {'a': 1}, 'mp4', output_path)
+
+    # A render to the same path truncates and rewrites the file
+    write(output_path, b'second')
+
+    assert read(cached_path) == b'first'
+
+
+def test_restored_output_is_not_shared_with_the_cache(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    output_path = str(tmp_path / 'video.mp4')
+    cached_path = cache.put_bytes('render', {'a': 1}, 'mp4', b'cached')
+
+    write(output_path, b'stale')
+    cache.restore(cached_path, output_path)
+
+    assert read(output_path) == b'cached'
+
+    write(output_path, b'rewritten')
+
+    assert read(cached_path) == b'cached'
+
+
+def test_evict_removes_the_least_recently_used(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'), max_bytes=10)
+    old = cache.put_bytes('render', {'a': 1}, 'mp4', b'x' * 6)
+    new = cache.put_bytes('render', {'a': 2}, 'mp4', b'x' * 6)
+    os.utime(old, (1, 1))
+
+    assert cache.evict() == 6
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from PIL import ImageFont
+
+from captions import highlight_intervals, load_font
+
+RASTER = np.zeros((1, 1, 4), dtype=np.uint8)
+
+
+def highlight(start, end):
+    return RASTER, 0, 0, start, end
+
+
+def test_words_are_highlighted_in_turn():
+    intervals = highlight_intervals([highlight(0.0, 0.5), highlight(0.5, 1.0)], 0.0, 1.0)
+
+    assert intervals == [(0.0, 0.5, (0,)), (0.5, 1.0, (1,))]
+
+
+def test_pauses_between_words_have_no_highlight():
+    intervals = highlight_intervals([highlight(0.2, 0.4), highlight(0.6, 0.8)], 0.0, 1.0)
+
+    assert [active for _, _, active in intervals] == [(), (0,), (), (1,), ()]
+
+
+def test_words_outside_the_line_are_clamped_to_it():
+    intervals = highlight_intervals([highlight(-0.5, 0.3), highlight(0.8, 1.5)], 0.0, 1.0)
+
+    assert intervals == [(0.0, 0.3, (0,)), (0.3, 0.8, ()), (0.8, 1.0, (1,))]
+
+
+def test_intervals_cover_the_line_without_gaps():
+    intervals = highlight_intervals([highlight(0.1, 0.35), highlight(0.3, 0.7)], 0.0, 1.0)
+
+    assert intervals[0][0] == 0.0 and intervals[-1][1] == 1.0
+    assert all(end == next_start for (_, end, _), (next_start, _, _) in zip(intervals, intervals[1:]))
+    assert (0.3, 0.35, (0, 1)) in intervals
+
+
+def test_missing_font_names_the_setting(monkeypatch):
+    def truetype(font, size):
+        raise OSError(f'cannot open resource {font}')
+
+    monkeypatch.setenv('CAPTION_FONT_PATH', '/nonexistent/font.ttf')
+    monkeypatch.setattr(ImageFont, 'truetype', truetype)
+
+    with pytest.raises(Exception, match='CAPTION_FONT_PATH'):
+        load_font('Missing-Font', 40)
@@ -0,0 +1,59 @@
+from moviepy.video.VideoClip import ColorClip
+
+from compositor import visible_spans, covers_frame
+
+SIZE = (40, 80)
+
+
+def layer(start, duration, size=SIZE, position=(0, 0)):
+    return ColorClip(size=size, color=(255, 0, 0)).set_duration(duration).set_start(start).set_position(position)
+
+
+def test_spans_split_at_clip_boundaries():
+    background = layer(0, 3)
+    first, second = layer(0, 1), layer(1, 2)
+
+    spans = visible_spans([background, first, second], SIZE, 3)
+
+    assert [(start, end) for start, end, _ in spans] == [(0.0, 1), (1, 3)]
+
+
+def test_layers_under_a_full_frame_layer_are_culled():
+    background = layer(0, 2)
+    stock = layer(0, 2)
+    caption = layer(0, 2, size=(10, 10), position=(5, 5))
+
+    (_, _, playing), = visible_spans([background, stock, caption], SIZE, 2)
+
+    assert playing == [stock, caption]
+
+
+def test_partial_and_offset_layers_do_not_cull():
+    background = layer(0, 2)
+    small = layer(0, 2, size=(10, 10))
+    shifted = layer(0, 2, position=(1, 0))
+
+    (_, _, playing), = visible_spans([background, small, shifted], SIZE, 2)
+
+    assert playing == [background, small, shifted]
+    assert covers_frame(background, SIZE)
+    assert not covers_frame(shifted, SIZE)
+
+
+def test_a_clip_is_not_playing_from_its_end():
+    background = layer(0, 2)
+    stock = layer(0, 1)
+
+    spans = visible_spans([background, stock], SIZE, 2)
+
+    assert spans[0][2] == [stock]
+    assert spans[1][2] == [background]
+
+
+def test_gaps_show_the_layers_below():
+    background = layer(0, 3)
+    stock = layer(1, 1)
+
+    spans = visible_spans([background, stock], SIZE, 3)
+
+    assert [playing for _, _, playing in spans] == [[background], [stock], [background]]
@@ -0,0 +1,101 @@
+import pytest
+from tenacity import stop_after_attempt
+
+from downloader import Downloader
+
+CONTENT = b'0123456789'
+
+
+class Response:
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+
+class Server:
+    # Serves CONTENT, honouring the Range header unless told not to
+    def __init__(self, ranges=True):
+        self.ranges = ranges
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(headers or {})
+        offset = int(headers['Range'][len('bytes='):-1]) if headers and 'Range' in headers else 0
+
+        if not offset or not self.ranges:
+            return Response(200, CONTENT, {'Content-Length': str(len(CONTENT))})
+
+        if offset >= len(CONTENT):
+            return Response(416)
+
+        return Response(206, CONTENT[offset:], {'Content-Range': f'bytes {offset}-{len(CONTENT) - 1}/{len(CONTENT)}'})
+
+
+def downloader(server):
+    downloader = Downloader(concurrency=1)
+    downloader.session = server
+
+    return downloader
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_a_partial_download_is_resumed(tmp_path):
+    path = str(tmp_path / 'video.mp4')
+    write(f'{path}.part', CONTENT[:4])
+    server = Server()
+
+    assert downloader(server).download('https://example.com/video.mp4', path) == path
+    assert server.requests == [{'Range': 'bytes=4-'}]
+    assert read(path) == CONTENT
+
+
+def test_a_server_without_ranges_restarts_the_download(tmp_path):
+    path = str(tmp_path / 'video.mp4')
+    write(f'{path}.part', b'stale')
+
+    downloader(Server(ranges=False)).download('https://example.com/video.mp4', path)
+
+    assert read(path) == CONTENT
+
+
+def test_a_complete_partial_file_is_kept(tmp_path):
+    path = str(tmp_path / 'video.mp4')
+    write(f'{path}.part', CONTENT)
+
+    downloader(Server()).download('https://example.com/video.mp4', path)
+
+    assert read(path) == CONTENT
+
+
+def test_a_truncated_download_is_not_kept(tmp_path):
+    path = str(tmp_path / 'video.mp4')
+    server = Server()
+    server.get = lambda url, **kwargs: Response(200, CONTENT[:4], {'Content-Length': str(len(CONTENT))})
+
+    download_once = Downloader.download_to_path.retry_with(stop=stop_after_attempt(1))
+
+    with pytest.raises(Exception):
+        download_once(downloader(server), 'https://example.com/video.mp4', path)
+
+    assert not (tmp_path / 'video.mp4').exists()
+    assert read(f'{path}.part') == CONTENT[:4]
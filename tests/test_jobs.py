@@ -0,0 +1,57 @@
+from jobs import JobStore
+
+
+def test_a_theme_keeps_its_job_across_runs(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    jobs = JobStore(path)
+    job_id = jobs.add('theme')
+    jobs.start(job_id)
+    jobs.start_stage(job_id, 'scenario')
+    jobs.complete_stage(job_id, 'scenario', 'scenario.json')
+    jobs.close()
+
+    # A new run of the batch opens the same database and picks up the finished stages
+    jobs = JobStore(path)
+
+    assert jobs.add('theme') == job_id
+    assert jobs.job(job_id)['status'] == 'running'
+    assert jobs.stage_artifact(job_id, 'scenario') == 'scenario.json'
+    assert jobs.stage_artifact(job_id, 'narration') is None
+
+
+def test_running_a_stage_again_invalidates_the_later_ones(tmp_path):
+    jobs = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    job_id = jobs.add('theme')
+
+    for stage in ['scenario', 'narration', 'subtitles']:
+        jobs.start_stage(job_id, stage)
+        jobs.complete_stage(job_id, stage, f'{stage}.json')
+
+    jobs.start_stage(job_id, 'narration')
+    jobs.complete_stage(job_id, 'narration', 'narration2.json')
+
+    assert jobs.stage_artifact(job_id, 'scenario') == 'scenario.json'
+    assert jobs.stage_artifact(job_id, 'narration') == 'narration2.json'
+    assert jobs.stage_artifact(job_id, 'subtitles') is None
+
+
+def test_failures_count_attempts_and_keep_the_error(tmp_path):
+    jobs = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    job_id = jobs.add('theme')
+
+    for _ in range(2):
+        jobs.start(job_id)
+        jobs.start_stage(job_id, 'scenario')
+        jobs.fail_stage(job_id, 'scenario', Exception('boom'))
+        jobs.fail(job_id, Exception('boom'))
+
+    job = jobs.job(job_id)
+
+    assert (job['status'], job['attempts'], job['error']) == ('failed', 2, "Exception('boom')")
+    assert jobs.stages(job_id)[0]['attempts'] == 2
+    assert jobs.stage_artifact(job_id, 'scenario') is None
+
+    jobs.start(job_id)
+    jobs.finish(job_id, 'theme.mp4')
+
+    assert jobs.jobs('done')[0]['output_path'] == 'theme.mp4'
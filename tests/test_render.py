@@ -0,0 +1,30 @@
+from dataobjects import StockClipSpec
+from render import segment_frames
+
+
+def clips(*starts):
+    return [StockClipSpec(f'{i}.mp4', start, 1.0) for i, start in enumerate(starts)]
+
+
+def test_segments_cover_every_frame_once():
+    segments = segment_frames(clips(0, 1.5, 3.2), 4.9, 24)
+
+    assert segments[0][0] == 0
+    assert segments[-1][1] == 118
+    assert all(end == next_start for (_, end), (next_start, _) in zip(segments, segments[1:]))
+
+
+def test_cuts_snap_to_the_nearest_frame():
+    assert segment_frames(clips(0, 1.02, 2.0), 3.0, 24) == [(0, 24), (24, 48), (48, 72)]
+
+
+def test_partial_last_frame_is_rendered():
+    assert segment_frames(clips(0), 1.01, 24) == [(0, 25)]
+
+
+def test_cuts_at_or_past_the_ends_are_ignored():
+    assert segment_frames(clips(0, 0.01, 3.0, 5.0), 3.0, 24) == [(0, 72)]
+
+
+def test_clips_starting_on_the_same_frame_make_one_cut():
+    assert segment_frames(clips(0, 1.0, 1.01), 2.0, 24) == [(0, 24), (24, 48)]
@@ -0,0 +1,76 @@
+import pytest
+
+import stock_library
+from stock_library import StockLibrary, ORIGINAL, TRIMMED, NORMALIZED
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.setattr(stock_library, 'probe', lambda path: {
+        'duration': 7.5, 'width': 1080, 'height': 1920, 'fps': 24.0, 'codec': 'h264',
+    })
+
+    return StockLibrary(str(tmp_path))
+
+
+def add_files(library, *filenames):
+    for filename in filenames:
+        with open(f'{library.folder}/{filename}', 'wb') as f:
+            f.write(b'x' * 10)
+
+
+def test_scan_indexes_every_kind_of_file(library):
+    add_files(
+        library,
+        '123.mov',
+        'trimmed_4.5_123.mov',
+        'trimmed_4.5_540x960_123.mov',
+        'normalized_123.mp4',
+        'normalized_123_540x960.mp4',
+    )
+    library.scan()
+
+    files = {row['path'].split('/')[-1]: row for row in library.files()}
+
+    assert {name: row['kind'] for name, row in files.items()} == {
+        '123.mov': ORIGINAL,
+        'trimmed_4.5_123.mov': TRIMMED,
+        'trimmed_4.5_540x960_123.mov': TRIMMED,
+        'normalized_123.mp4': NORMALIZED,
+        'normalized_123_540x960.mp4': NORMALIZED,
+    }
+    assert {row['pexels_id'] for row in files.values()} == {'123'}
+    assert files['trimmed_4.5_540x960_123.mov']['requested_duration'] == 4.5
+    assert files['normalized_123_540x960.mp4']['source_path'] == f'{library.folder}/123.mov'
+    assert files['normalized_123_540x960.mp4']['requested_duration'] == 7.5
+
+
+def test_evict_removes_rebuildable_files_before_orphans_and_originals(library):
+    add_files(library, '1.mp4', '2.mp4', 'normalized_1.mp4', 'normalized_3.mp4')
+    library.add(f'{library.folder}/1.mp4', ORIGINAL, 1)
+    library.add(f'{library.folder}/2.mp4', ORIGINAL, 2)
+    library.add(f'{library.folder}/normalized_1.mp4', NORMALIZED, 1, source_path=f'{library.folder}/1.mp4')
+    # Its original is gone, so it would have to be downloaded again
+    library.add(f'{library.folder}/normalized_3.mp4', NORMALIZED, 3, source_path=f'{library.folder}/3.mp4')
+
+    library.max_bytes = 30
+    library.evict()
+
+    assert sorted(row['path'].split('/')[-1] for row in library.files()) == ['1.mp4', '2.mp4', 'normalized_3.mp4']
+
+    library.max_bytes = 10
+    library.evict()
+
+    assert [row['path'].split('/')[-1] for row in library.files()] == ['2.mp4']
+
+
+def test_evict_removes_the_least_recently_used_first(library):
+    add_files(library, '1.mp4', '2.mp4')
+    library.add(f'{library.folder}/1.mp4', ORIGINAL, 1)
+    library.add(f'{library.folder}/2.mp4', ORIGINAL, 2)
+    library.touch(f'{library.folder}/1.mp4')
+
+    library.max_bytes = 10
+    library.evict()
+
+    assert [row['path'].split('/')[-1] for row in library.files()] == ['1.mp4']
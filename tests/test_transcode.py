@@ -0,0 +1,69 @@
+import re
+
+from dataobjects import StockClipSpec
+from transcode import compose_args
+
+FPS = 24
+
+
+def filter_graph(clips, duration=10.0):
+    args = compose_args(clips, 'captions.ffconcat', 'narration.mp3', 'music.mp3', duration, 'out.mp4', fps=FPS)
+
+    return args, args[args.index('-filter_complex') + 1]
+
+
+def stock_filters(graph):
+    return [part for part in graph.split(';') if re.match(r'\[\d+:v\]scale', part)]
+
+
+def frames(part, name):
+    match = re.search(rf'{name}=(\d+)', part)
+
+    return int(match.group(1)) if match else 0
+
+
+def test_contiguous_clips_have_no_gap_from_round_off():
+    starts = [0, 0.7, 0.8, 2.5]
+    ends = starts[1:] + [3.04]
+    clips = [StockClipSpec(f'{i}.mp4', start, end - start) for i, (start, end) in enumerate(zip(starts, ends))]
+
+    _, graph = filter_graph(clips, 3.04)
+
+    assert 'e-' not in graph
+    assert all(frames(part, 'tpad=start') == 0 for part in stock_filters(graph))
+
+
+def test_clip_lengths_add_up_on_the_frame_grid():
+    clips = [StockClipSpec(f'{i}.mp4', i * 0.51, 0.51) for i in range(20)]
+
+    _, graph = filter_graph(clips, 10.2)
+
+    assert sum(frames(part, 'trim=end_frame') for part in stock_filters(graph)) == round(20 * 0.51 * FPS)
+
+
+def test_gaps_are_padded_in_whole_frames():
+    clips = [StockClipSpec('a.mp4', 0, 0.5), StockClipSpec('b.mp4', 1.0, 0.5)]
+
+    _, graph = filter_graph(clips)
+    first, second = stock_filters(graph)
+
+    assert frames(first, 'trim=end_frame') == 12 and frames(first, 'tpad=start') == 0
+    assert frames(second, 'trim=end_frame') == 12 and frames(second, 'tpad=start') == 12
+
+
+def test_clips_shorter_than_a_frame_are_left_out():
+    clips = [StockClipSpec('a.mp4', 0, 1.0), StockClipSpec('b.mp4', 1.0, 0.01), StockClipSpec('c.mp4', 1.01, 1.0)]
+
+    args, graph = filter_graph(clips)
+
+    assert 'b.mp4' not in args
+    assert len(stock_filters(graph)) == 2
+    # The captions come right after the stock inputs that were kept
+    assert '[2:v]format=rgba[captions]' in graph
+
+
+def test_durations_are_written_with_fixed_precision():
+    args, graph = filter_graph([StockClipSpec('a.mp4', 0, 1.0)], 0.1 + 0.2)
+
+    assert args[args.index('-t') + 1] == '0.300'
+    assert 'd=0.300[bg]' in graph
@@ -0,0 +1,143 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+current_track = contextvars.ContextVar('current_track', default=None)
+
+
+class Tracer:
+    def __init__(self):
+        self.events = []
+
+    @staticmethod
+    def now() -> int:
+        # Wall clock microseconds, so spans recorded in render workers line up with the main process
+        return time.time_ns() // 1000
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args):
+        start = self.now()
+
+        try:
+            yield
+        finally:
+            self.events.append({
+                'name': name,
+                'ts': start,
+                'dur': self.now() - start,
+                'pid': os.getpid(),
+                'track': current_track.get() or threading.current_thread().name,
+                'args': args,
+            })
+
+    @contextlib.contextmanager
+    def track(self, name: str):
+        token = current_track.set(name)
+
+        try:
+            yield
+        finally:
+            current_track.reset(token)
+
+    def drain(self) -> List[dict]:
+        events, self.events = self.events, []
+
+        return events
+
+    def extend(self, events: List[dict]):
+        self.events.extend(events)
+
+    def chrome_trace(self) -> dict:
+        tracks = {}
+        trace_events = []
+
+        for event in self.events:
+            tid = tracks.setdefault((event['pid'], event['track']), len(tracks) + 1)
+            trace_events.append({
+                'name': event['name'],
+                'cat': 'stage',
+                'ph': 'X',
+                'ts': event['ts'],
+                'dur': event['dur'],
+                'pid': event['pid'],
+                'tid': tid,
+                'args': event['args'],
+            })
+
+        for (pid, track), tid in tracks.items():
+            trace_events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': pid,
+                'tid': tid,
+                'args': {'name': str(track)},
+            })
+
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def summary(self) -> str:
+        stats = {}
+
+        for event in self.events:
+            count, total, longest = stats.get(event['name'], (0, 0, 0))
+            stats[event['name']] = (count + 1, total + event['dur'], max(longest, event['dur']))
+
+        rows = [f'{"span":<40} {"count":>6} {"total s":>10} {"mean s":>10} {"max s":>10}']
+        for name, (count, total, longest) in sorted(stats.items(), key=lambda item: -item[1][1]):
+            rows.append(
+                f'{name:<40} {count:>6} {total / 1e6:>10.2f} {total / count / 1e6:>10.2f} {longest / 1e6:>10.2f}'
+            )
+
+        return '\n'.join(rows)
+
+    def export(self, directory: str, run_name: Optional[str] = None) -> str:
+        run_name = run_name or datetime.now().strftime('%Y%m%d_%H%M%S')
+        Path(directory).mkdir(parents=True, exist_ok=True)
+
+        trace_path = f'{directory}/trace_{run_name}.json'
+        with open(trace_path, 'w') as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False)
+
+        summary = self.summary()
+        with open(f'{directory}/trace_{run_name}.txt', 'w') as f:
+            f.write(summary + '\n')
+
+        logger.info(f'Trace written to {trace_path}\n{summary}')
+
+        return trace_path
+
+
+tracer = Tracer()
+
+
+def traced(name: Optional[str] = None):
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(span_name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
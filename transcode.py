@@ -0,0 +1,341 @@
+import json
+import logging
+import os
+import shutil
+import subprocess
+from typing import List, Optional, Tuple
+
+import numpy as np
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from dataobjects import StockClipSpec, EncodingProfile, ENCODING_PROFILES, OutputTarget
+
+logger = logging.getLogger(__name__)
+
+
+def ffmpeg_binary() -> str:
+    return get_setting('FFMPEG_BINARY')
+
+
+def run_ffmpeg(args: List[str]):
+    command = [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-y', *args]
+    logger.debug(' '.join(command))
+
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    if result.returncode != 0:
+        raise Exception(f'ffmpeg failed ({result.returncode}): {result.stderr.decode(errors="replace")}')
+
+
+def cover_filter(width: int, height: int) -> str:
+    # Scale preserving the aspect ratio until the frame is covered, then cut the center out
+    return (
+        f'scale={width}:{height}:force_original_aspect_ratio=increase,'
+        f'crop={width}:{height},'
+        f'setsar=1'
+    )
+
+
+def trim_args(
+    source_path: str,
+    output_path: str,
+    start: float,
+    duration: float,
+    target_dimensions: tuple[int, int],
+    fps: Optional[float] = None,
+    codec: str = 'libx264',
+    preset: str = 'medium',
+    keyframe_interval: Optional[int] = None,
+) -> List[str]:
+    video_filter = cover_filter(*target_dimensions)
+
+    if fps is not None:
+        video_filter += f',fps={fps}'
+
+    keyframe_args = []
+    if keyframe_interval is not None:
+        keyframe_args = ['-g', f'{keyframe_interval}', '-keyint_min', f'{keyframe_interval}', '-sc_threshold', '0']
+
+    return [
+        '-ss', f'{start}',
+        '-t', f'{duration:.3f}',
+        '-i', source_path,
+        '-vf', video_filter,
+        '-an',
+        '-c:v', codec,
+        '-preset', preset,
+        *keyframe_args,
+        '-pix_fmt', 'yuv420p',
+        '-movflags', '+faststart',
+        '-f', 'mp4',
+        output_path,
+    ]
+
+
+def trim_video(source_path: str, output_path: str, duration: float, target_dimensions: tuple[int, int], **kwargs):
+    # Written next to the target and renamed, so an interrupted encode is never mistaken for a cached file
+    tmp_path = f'{output_path}.tmp'
+
+    try:
+        run_ffmpeg(trim_args(source_path, tmp_path, 0, duration, target_dimensions, **kwargs))
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def normalize_video(
+    source_path: str,
+    output_path: str,
+    duration: float,
+    target_dimensions: tuple[int, int],
+    fps: int = 24,
+    preset: str = 'medium',
+):
+    # A keyframe every second, so subclips cut from the intermediate start on a keyframe
+    trim_video(source_path, output_path, duration, target_dimensions, fps=fps, preset=preset, keyframe_interval=fps)
+
+
+def compose_args(
+    stock_clips: List[StockClipSpec],
+    captions_playlist_path: str,
+    narration_path: str,
+    music_path: str,
+    duration: float,
+    output_path: str,
+    frame_size: tuple[int, int] = (1080, 1920),
+    fps: int = 24,
+    encoding: EncodingProfile = ENCODING_PROFILES['production'],
+    music_volume: float = 0.08,
+    audio_path: Optional[str] = None,
+) -> List[str]:
+    width, height = frame_size
+    inputs = []
+    filters = []
+    segments = []
+
+    # The timeline is laid out in whole frames, like segment_frames does, so rounding neither builds up
+    # along the clips nor ends up in the filter as a sub-frame gap
+    position = 0
+    for clip in sorted(stock_clips, key=lambda clip: clip.start):
+        start = max(round(clip.start * fps), position)
+        end = round((clip.start + clip.duration) * fps)
+
+        if end <= start:
+            continue
+
+        i = len(segments)
+        inputs += ['-i', clip.path]
+
+        # Black is shown for gaps in the timeline, and a source that is too short holds its last frame
+        gap = f'tpad=start={start - position}:color=black,' if start > position else ''
+        filters.append(
+            f'[{i}:v]{cover_filter(width, height)},fps={fps},'
+            f'tpad=stop_mode=clone:stop={end - start},trim=end_frame={end - start},'
+            f'{gap}setpts=PTS-STARTPTS,format=yuv420p[s{i}]'
+        )
+        segments.append(f'[s{i}]')
+        position = end
+
+    captions_index = len(segments)
+    narration_index = captions_index + 1
+    music_index = captions_index + 2
+
+    inputs += ['-f', 'concat', '-safe', '0', '-i', captions_playlist_path]
+
+    # A premixed track is muxed as it is, otherwise the narration and the music are mixed here
+    if audio_path is not None:
+        inputs += ['-i', audio_path]
+    else:
+        inputs += ['-i', narration_path]
+        inputs += ['-i', music_path]
+
+    filters.append(f'color=c=black:s={width}x{height}:r={fps}:d={duration:.3f}[bg]')
+
+    if segments:
+        filters.append(f'{"".join(segments)}concat=n={len(segments)}:v=1:a=0[stock]')
+        filters.append('[bg][stock]overlay=eof_action=pass[base]')
+    else:
+        filters.append('[bg]null[base]')
+
+    filters.append(f'[{captions_index}:v]format=rgba[captions]')
+    filters.append('[base][captions]overlay=eof_action=pass,format=yuv420p[v]')
+
+    if audio_path is None:
+        filters += audio_mix_filters(narration_index, music_index, music_volume)
+
+    return [
+        *inputs,
+        '-filter_complex', ';'.join(filters),
+        '-map', '[v]',
+        '-map', '[a]' if audio_path is None else f'{narration_index}:a',
+        '-t', f'{duration:.3f}',
+        '-r', f'{fps}',
+        *encoding.ffmpeg_args(),
+        '-c:a', 'aac' if audio_path is None else 'copy',
+        '-movflags', '+faststart',
+        output_path,
+    ]
+
+
+def split_args(
+    frame_size: tuple[int, int],
+    fps: int,
+    outputs: List[Tuple[OutputTarget, str]],
+    encoding: EncodingProfile,
+    audio_path: Optional[str] = None,
+) -> List[str]:
+    # Raw frames come in on stdin once and are split to one scaler and encoder per target
+    width, height = frame_size
+    inputs = ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', f'{fps}', '-i', '-']
+
+    if audio_path is not None:
+        inputs += ['-i', audio_path]
+
+    filters = [f'[0:v]split={len(outputs)}{"".join(f"[in{i}]" for i in range(len(outputs)))}']
+    for i, (target, _) in enumerate(outputs):
+        # A target with another aspect ratio gets the center of the frame, like the stock footage does
+        filters.append(f'[in{i}]{cover_filter(*target.frame_size)}[out{i}]')
+
+    args = [*inputs, '-filter_complex', ';'.join(filters)]
+
+    for i, (target, output_path) in enumerate(outputs):
+        args += ['-map', f'[out{i}]']
+
+        if audio_path is not None:
+            args += ['-map', '1:a', '-c:a', 'copy']
+
+        args += [*target.profile(encoding).ffmpeg_args(), '-movflags', '+faststart', output_path]
+
+    return args
+
+
+def open_ffmpeg(args: List[str]) -> subprocess.Popen:
+    command = [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-y', *args]
+    logger.debug(' '.join(command))
+
+    return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def audio_mix_filters(narration_index: int, music_index: int, music_volume: float = 0.08) -> List[str]:
+    return [
+        f'[{narration_index}:a]aresample=44100[narration]',
+        f'[{music_index}:a]volume={music_volume},aresample=44100[music]',
+        '[narration][music]amix=inputs=2:duration=first:normalize=0[a]',
+    ]
+
+
+def write_concat_list(paths: List[str], list_path: str) -> str:
+    with open(list_path, 'w') as f:
+        f.write('ffconcat version 1.0\n')
+
+        for path in paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+
+    return list_path
+
+
+def concat_args(
+    segments_list_path: str,
+    narration_path: str,
+    music_path: str,
+    duration: float,
+    output_path: str,
+    music_volume: float = 0.08,
+    audio_path: Optional[str] = None,
+) -> List[str]:
+    # The segments share one encoding, so they are joined without re-encoding and the audio is mixed once
+    if audio_path is not None:
+        audio_args = ['-i', audio_path, '-map', '0:v', '-map', '1:a', '-c:a', 'copy']
+    else:
+        audio_args = [
+            '-i', narration_path,
+            '-i', music_path,
+            '-filter_complex', ';'.join(audio_mix_filters(1, 2, music_volume)),
+            '-map', '0:v',
+            '-map', '[a]',
+            '-c:a', 'aac',
+        ]
+
+    return [
+        '-f', 'concat', '-safe', '0', '-i', segments_list_path,
+        *audio_args,
+        '-t', f'{duration:.3f}',
+        '-c:v', 'copy',
+        '-movflags', '+faststart',
+        output_path,
+    ]
+
+
+def decode_audio(path: str, sample_rate: int = 44100, channels: int = 2) -> np.ndarray:
+    result = subprocess.run(
+        [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-i', path, '-vn',
+         '-f', 'f32le', '-ac', f'{channels}', '-ar', f'{sample_rate}', '-'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    if result.returncode != 0:
+        raise Exception(f'ffmpeg could not decode {path}: {result.stderr.decode(errors="replace")}')
+
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels)
+
+
+def encode_audio_args(source_path: str, output_path: str, bitrate: str = '192k') -> List[str]:
+    return [
+        '-i', source_path,
+        '-c:a', 'aac',
+        '-b:a', bitrate,
+        '-movflags', '+faststart',
+        '-f', 'mp4',
+        output_path,
+    ]
+
+
+def media_duration(path: str) -> float:
+    return ffmpeg_parse_infos(path)['duration']
+
+
+def probe(path: str) -> dict:
+    ffprobe = os.getenv('FFPROBE_BINARY') or shutil.which('ffprobe')
+
+    if ffprobe is None:
+        # ffprobe does not ship with imageio-ffmpeg, so fall back to what `ffmpeg -i` reports
+        infos = ffmpeg_parse_infos(path)
+        width, height = infos.get('video_size') or (None, None)
+
+        return {
+            'duration': infos.get('duration'),
+            'width': width,
+            'height': height,
+            'fps': infos.get('video_fps'),
+            'codec': None,
+        }
+
+    result = subprocess.run(
+        [
+            ffprobe, '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'stream=codec_name,width,height,avg_frame_rate:format=duration',
+            '-of', 'json',
+            path,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    if result.returncode != 0:
+        raise Exception(f'ffprobe failed for {path}: {result.stderr.decode(errors="replace")}')
+
+    info = json.loads(result.stdout)
+    stream = (info.get('streams') or [{}])[0]
+    numerator, _, denominator = stream.get('avg_frame_rate', '0/1').partition('/')
+
+    return {
+        'duration': float(info.get('format', {}).get('duration', 0)) or None,
+        'width': stream.get('width'),
+        'height': stream.get('height'),
+        'fps': float(numerator) / float(denominator) if float(denominator or 0) else None,
+        'codec': stream.get('codec_name'),
+    }